@@ -0,0 +1,122 @@
+"""Local stand-in for the Cortana API and the Discord CDN, for benchmarking
+
+Run standalone with:
+    python benchmarks/fake_cortana_api.py --port 8765 --latency 0.5 --stream
+"""
+import argparse
+import asyncio
+import json
+import random
+
+from aiohttp import web
+
+
+class FakeCortanaAPI:
+    """aiohttp app mimicking /chat, /reset and /health, plus CDN and TTS audio downloads"""
+
+    def __init__(self, latency=0.2, jitter=0.0, stream=False, tokens=40, token_delay=0.02,
+                 audio_url=True, audio_bytes=48_000):
+        self.latency = latency
+        self.jitter = jitter
+        self.stream = stream
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.audio_url = audio_url
+        self.audio_bytes = audio_bytes
+        self.files = {}  # CDN path -> bytes
+        self.base_url = None
+        self.users = set()  # distinct conversation ids seen by /chat
+        self.stats = {'chat': 0, 'reset': 0, 'cdn': 0, 'audio': 0, 'upload_bytes': 0, 'users': 0}
+
+    def build_app(self):
+        app = web.Application(client_max_size=200 * 1024 * 1024)
+        app.router.add_post('/chat', self.chat)
+        app.router.add_post('/reset', self.reset)
+        app.router.add_get('/health', self.health)
+        app.router.add_get('/cdn/{name}', self.cdn)
+        app.router.add_get('/audio/{name}', self.audio)
+        return app
+
+    def add_file(self, name, data):
+        """Serve bytes from the fake CDN and return their URL"""
+        self.files[name] = data
+        return f'{self.base_url}/cdn/{name}'
+
+    async def start(self, host='127.0.0.1', port=0):
+        runner = web.AppRunner(self.build_app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://{host}:{port}'
+        return runner
+
+    async def _think(self):
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    async def chat(self, request):
+        self.stats['chat'] += 1
+        form = await request.post()
+        self.users.add(form.get('user'))
+        self.stats['users'] = len(self.users)
+        for value in form.values():
+            if isinstance(value, web.FileField):
+                self.stats['upload_bytes'] += len(value.file.read())
+
+        await self._think()
+        words = [f'word{i}' for i in range(self.tokens)]
+        audio_url = None
+        if self.audio_url and form.get('include_audio') == 'true':
+            audio_url = f'{self.base_url}/audio/{random.getrandbits(32):08x}.mp3'
+
+        if not (self.stream and form.get('stream') == 'true'):
+            return web.json_response({'response': ' '.join(words), 'audio_url': audio_url})
+
+        resp = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await resp.prepare(request)
+        for word in words:
+            await resp.write(f'data: {json.dumps({"delta": word + " "})}\n\n'.encode())
+            await asyncio.sleep(self.token_delay)
+        if audio_url:
+            await resp.write(f'data: {json.dumps({"audio_url": audio_url})}\n\n'.encode())
+        await resp.write(b'data: [DONE]\n\n')
+        await resp.write_eof()
+        return resp
+
+    async def reset(self, request):
+        self.stats['reset'] += 1
+        return web.json_response({'status': 'ok'})
+
+    async def health(self, request):
+        return web.json_response({'status': 'ok'})
+
+    async def cdn(self, request):
+        data = self.files.get(request.match_info['name'])
+        if data is None:
+            raise web.HTTPNotFound()
+        self.stats['cdn'] += 1
+        return web.Response(body=data, content_type='application/octet-stream')
+
+    async def audio(self, request):
+        self.stats['audio'] += 1
+        return web.Response(body=b'\xff\xfb' + b'\0' * self.audio_bytes, content_type='audio/mpeg')
+
+
+async def serve(args):
+    api = FakeCortanaAPI(latency=args.latency, jitter=args.jitter, stream=args.stream)
+    await api.start(args.host, args.port)
+    print(f"🧪 Fake Cortana API listening on {api.base_url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake Cortana API for local testing')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds before replying')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--stream', action='store_true', help='stream replies as server-sent events')
+    try:
+        asyncio.run(serve(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
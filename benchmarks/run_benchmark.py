@@ -0,0 +1,274 @@
+"""Replay synthetic conversations through Client.on_message against a local fake Cortana API
+
+Examples:
+    python benchmarks/run_benchmark.py --conversations 20 --messages 5
+    python benchmarks/run_benchmark.py --stream --voice-ratio 0.3 --compare benchmarks/results/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from fake_cortana_api import FakeCortanaAPI  # noqa: E402
+from synthetic_discord import (  # noqa: E402
+    FakeAttachment, FakeAuthor, FakeChannel, FakeGuild, FakeMessage, make_png, make_voice_note,
+)
+
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, 'results')
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'mean': statistics.fmean(values) if values else None,
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None,
+    }
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024) if platform.system() == 'Darwin' else peak / 1024
+
+
+class LoopLagMonitor:
+    """Measure how late the event loop wakes up a sleeping task"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+class Benchmark:
+    def __init__(self, args, api, bot):
+        self.args = args
+        self.api = api
+        self.bot = bot
+        self.client = bot.client
+        self.assets = {}
+        self.done = {}  # message id -> future resolved when the bot finished handling it
+        self.latencies = []
+        self.first_reply = []
+        self.rejected = 0
+        self.errors = 0
+
+    def prepare_assets(self):
+        image = make_png(self.args.image_size, self.args.image_size)
+        voice = make_voice_note()
+        self.assets = {
+            'image': ('photo.png', self.api.add_file('photo.png', image), image, 'image/png'),
+            'voice': ('voice-message.ogg', self.api.add_file('voice-message.ogg', voice), voice, 'audio/ogg'),
+        }
+
+    def attachment(self, kind):
+        filename, url, data, content_type = self.assets[kind]
+        return FakeAttachment(filename, url, data, content_type)
+
+    def build_message(self, channel, author, rng):
+        roll = rng.random()
+        if roll < self.args.voice_ratio:
+            return FakeMessage(channel, author, '', [self.attachment('voice')])
+        if roll < self.args.voice_ratio + self.args.image_ratio:
+            return FakeMessage(channel, author, 'What is in this picture?', [self.attachment('image')])
+        return FakeMessage(channel, author, f'Benchmark question {rng.randrange(10_000)}')
+
+    def instrument(self):
+        """Resolve a future per message once the scheduler's handler returns"""
+        handler = self.client.scheduler.handler
+
+        async def instrumented(messages):
+            try:
+                await handler(messages)
+            finally:
+                finished = time.perf_counter()
+                for message in messages:
+                    future = self.done.pop(message.id, None)
+                    if future and not future.done():
+                        future.set_result(finished)
+
+        self.client.scheduler.handler = instrumented
+
+    async def conversation(self, index):
+        rng = random.Random(index)
+        guild = FakeGuild()
+        channel = FakeChannel(guild)
+        author = FakeAuthor(f'user{index}')
+        for _ in range(self.args.messages):
+            message = self.build_message(channel, author, rng)
+            future = asyncio.get_running_loop().create_future()
+            self.done[message.id] = future
+            sent_before = len(channel.sent)
+            started = time.perf_counter()
+            await self.client.on_message(message)
+
+            if len(channel.sent) > sent_before and '⏳' in channel.sent[sent_before][1].content:
+                self.done.pop(message.id, None)
+                self.rejected += 1
+            else:
+                try:
+                    finished = await asyncio.wait_for(future, self.args.timeout)
+                except asyncio.TimeoutError:
+                    self.errors += 1
+                    continue
+                self.latencies.append(finished - started)
+                replies = channel.sent[sent_before:]
+                if replies:
+                    self.first_reply.append(replies[0][0] - started)
+                    if any('Sorry' in (sent.content or '') for _, sent in replies):
+                        self.errors += 1
+            if self.args.think_time:
+                await asyncio.sleep(rng.uniform(0, self.args.think_time))
+
+    async def run(self):
+        self.prepare_assets()
+        await self.client.setup_hook()
+        self.instrument()
+        monitor = LoopLagMonitor()
+        monitor.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(self.conversation(i) for i in range(self.args.conversations)))
+        elapsed = time.perf_counter() - started
+        await monitor.stop()
+
+        handled = len(self.latencies)
+        return {
+            'label': self.args.label,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'config': {key: value for key, value in vars(self.args).items() if key not in ('compare', 'output')},
+            'elapsed_seconds': elapsed,
+            'messages_handled': handled,
+            'messages_rejected': self.rejected,
+            'errors': self.errors,
+            'throughput_per_second': handled / elapsed if elapsed else None,
+            'latency_seconds': summarize(self.latencies),
+            'first_reply_seconds': summarize(self.first_reply),
+            'loop_lag_seconds': summarize(monitor.lags),
+            'peak_rss_mb': peak_rss_mb(),
+            'api_stats': self.api.stats,
+            'http_stats': dict(self.client.http_stats),
+            'scheduler_stats': dict(self.client.scheduler.stats),
+            'transcoder_stats': dict(self.client.transcoder.stats),
+            'image_stats': dict(self.client.image_processor.stats) if self.client.image_processor else None,
+            'trace_stats': dict(self.bot.tracer.stats),
+            'trace_file': self.bot.tracer.path,
+            'cache_stats': dict(self.client.media_cache.stats) if self.client.media_cache else None,
+        }
+
+
+def print_report(result, baseline=None):
+    def fmt(value, unit=''):
+        if value is None:
+            return '-'
+        return f'{value * 1000:.1f} ms' if unit == 's' else f'{value:.2f}{unit}'
+
+    def line(name, value, base_value, unit=''):
+        text = f'  {name:<22}{fmt(value, unit):>12}'
+        if base_value not in (None, 0) and value is not None:
+            text += f'   ({(value - base_value) / base_value * 100:+.1f}% vs baseline)'
+        print(text)
+
+    base = baseline or {}
+    print(f"\n📊 Benchmark '{result['label']}': {result['messages_handled']} handled, "
+          f"{result['messages_rejected']} rejected, {result['errors']} errors in {result['elapsed_seconds']:.2f}s")
+    line('throughput (msg/s)', result['throughput_per_second'], base.get('throughput_per_second'))
+    for section, name in (('latency_seconds', 'latency'), ('first_reply_seconds', 'first reply'),
+                          ('loop_lag_seconds', 'loop lag')):
+        for stat in ('p50', 'p95', 'p99'):
+            line(f'{name} {stat}', result[section][stat], base.get(section, {}).get(stat), 's')
+    line('peak RSS (MB)', result['peak_rss_mb'], base.get('peak_rss_mb'))
+
+
+async def main(args):
+    api = FakeCortanaAPI(latency=args.latency, jitter=args.jitter, stream=args.stream)
+    runner = await api.start()
+
+    # Configure the bot before importing it; the module reads its settings at import time
+    os.environ['CORTANA_API_URL'] = api.base_url
+    os.environ.setdefault('BEARER_TOKEN', 'benchmark')
+    os.environ['HTTP_SERVER_ENABLED'] = 'false'
+    os.environ['CORTANA_STREAM_REPLIES'] = 'true' if args.stream else 'false'
+    os.environ['SCHEDULER_DEBOUNCE'] = str(args.debounce)
+    os.environ['CACHE_ENABLED'] = 'true' if args.cache else 'false'
+    os.environ.setdefault('CACHE_DIR', tempfile.mkdtemp(prefix='cortana-bench-cache-'))
+    # Keep benchmark traces out of data/; summarize them with scripts/trace_summary.py
+    os.environ.setdefault('TRACE_FILE', os.path.join(tempfile.mkdtemp(prefix='cortana-bench-traces-'), 'traces.jsonl'))
+    import discord_bot
+
+    try:
+        # Entering the client prepares its internals without logging in to Discord
+        async with discord_bot.client:
+            result = await Benchmark(args, api, discord_bot).run()
+    finally:
+        await runner.cleanup()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark Client.on_message against a fake Cortana API')
+    parser.add_argument('--label', default='run')
+    parser.add_argument('--conversations', type=int, default=10, help='concurrent conversations')
+    parser.add_argument('--messages', type=int, default=5, help='messages per conversation')
+    parser.add_argument('--latency', type=float, default=0.2, help='fake API latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--stream', action='store_true', help='stream replies as server-sent events')
+    parser.add_argument('--voice-ratio', type=float, default=0.2, help='share of messages that are .ogg voice notes')
+    parser.add_argument('--image-ratio', type=float, default=0.2, help='share of messages with an image')
+    parser.add_argument('--image-size', type=int, default=1024, help='synthetic image width/height in pixels')
+    parser.add_argument('--think-time', type=float, default=0.0, help='max random pause between messages')
+    parser.add_argument('--debounce', type=float, default=0.0, help='scheduler debounce window')
+    parser.add_argument('--cache', action='store_true', help='enable the media cache')
+    parser.add_argument('--timeout', type=float, default=60.0, help='per-message timeout')
+    parser.add_argument('--output', help='result file (default: benchmarks/results/<label>-<time>.json)')
+    parser.add_argument('--compare', help='earlier result file to compare against')
+    args = parser.parse_args()
+
+    result = asyncio.run(main(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{args.label}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"💾 Results saved to {output}")
@@ -0,0 +1,105 @@
+"""Minimal stand-ins for discord.py Message/Attachment objects used by the benchmarks"""
+import itertools
+import random
+import shutil
+import struct
+import subprocess
+import time
+import zlib
+
+_ids = itertools.count(1_000_000)
+
+
+def next_id():
+    return next(_ids)
+
+
+class FakeAttachment:
+    def __init__(self, filename, url, data, content_type):
+        self.id = next_id()
+        self.filename = filename
+        self.url = url
+        self.size = len(data)
+        self.content_type = content_type
+
+
+class FakeAuthor:
+    def __init__(self, name):
+        self.id = next_id()
+        self.name = name
+        self.display_name = name
+        self.mention = f'<@{self.id}>'
+        self.bot = False
+
+
+class FakeGuild:
+    def __init__(self):
+        self.id = next_id()
+        self.voice_client = None
+
+
+class FakeSentMessage:
+    def __init__(self, channel, content):
+        self.id = next_id()
+        self.channel = channel
+        self.content = content
+        self.edits = 0
+        self.deleted = False
+
+    async def edit(self, content=None, **kwargs):
+        self.content = content
+        self.edits += 1
+        self.channel.edits += 1
+
+    async def delete(self):
+        self.deleted = True
+
+
+class FakeChannel:
+    """Records everything the bot sends, with timestamps"""
+
+    def __init__(self, guild):
+        self.id = next_id()
+        self.guild = guild
+        self.sent = []  # (perf_counter timestamp, FakeSentMessage)
+        self.edits = 0
+
+    async def send(self, content=None, **kwargs):
+        sent = FakeSentMessage(self, content)
+        self.sent.append((time.perf_counter(), sent))
+        return sent
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content='', attachments=()):
+        self.id = next_id()
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.attachments = list(attachments)
+
+
+def make_png(width=640, height=480, seed=0):
+    """Build a valid RGB PNG with noisy content so it does not compress to nothing"""
+    rng = random.Random(seed)
+    rows = b''.join(b'\x00' + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(tag, body):
+        return struct.pack('>I', len(body)) + tag + body + struct.pack('>I', zlib.crc32(tag + body))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(rows, 1)) + chunk(b'IEND', b'')
+
+
+def make_voice_note(seconds=3.0):
+    """Build an Opus-in-Ogg voice note like Discord's, or placeholder bytes if FFmpeg is missing"""
+    if shutil.which('ffmpeg'):
+        result = subprocess.run([
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-f', 'lavfi', '-i', f'sine=frequency=220:duration={seconds}',
+            '-ar', '48000', '-ac', '1', '-c:a', 'libopus', '-f', 'ogg', 'pipe:1',
+        ], capture_output=True)
+        if result.returncode == 0:
+            return result.stdout
+    return b'OggS' + random.Random(1).randbytes(int(seconds * 4000))
@@ -7,30 +7,71 @@ import subprocess
 import platform
 from discord.ext import commands
 import aiohttp
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from aiohttp import web
 import time
+import json
+import hashlib
+import io
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+import random
+import multiprocessing
+import queue
+import concurrent.futures
+import contextvars
+import logging
+import logging.handlers
+import sys
+import math
+import wave
+import threading
+from array import array
 
 # Load environment variables from .env file FIRST
 load_dotenv()
 
+
+def env_flag(name, default):
+    """Read a boolean setting; 1, true and yes (any case) turn it on, anything else turns it off"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes')
+
+
 BEARER_TOKEN = os.getenv('BEARER_TOKEN')
 # DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
 DISCORD_SERVER_ID = os.getenv('SERVER_ID')
 CORTANA_API_URL = os.getenv('CORTANA_API_URL')
 BOT_TOKEN = os.getenv('BOT_TOKEN')
+BEARER_TOKEN_RELOAD_INTERVAL = 5.0  # seconds between .env re-reads while the token is missing
+_bearer_token_checked = 0.0
 if not BEARER_TOKEN:
-    #scan for changes in .env file
-    while True:
+    print("❌ Error: BEARER_TOKEN environment variable not set!")
+    print("Please set your Cortana API bearer token in the environment variables.")
+
+
+class MissingConfiguration(Exception):
+    """Raised when required configuration such as BEARER_TOKEN is not available yet"""
+
+
+def get_bearer_token():
+    """Return the Cortana API bearer token, re-reading .env (at most every few seconds) while it is unset"""
+    global BEARER_TOKEN, _bearer_token_checked
+    if not BEARER_TOKEN and time.monotonic() - _bearer_token_checked >= BEARER_TOKEN_RELOAD_INTERVAL:
+        _bearer_token_checked = time.monotonic()
         load_dotenv()  # Reload .env file
         BEARER_TOKEN = os.getenv('BEARER_TOKEN')
         if BEARER_TOKEN:
-            print(f"✅ BEARER_TOKEN environment variable set")
-            break
-        else:
-            print("❌ Error: BEARER_TOKEN environment variable not set!")
-            print("Please set your Cortana API bearer token in the environment variables.")
-        time.sleep(1)
+            print("✅ BEARER_TOKEN environment variable set")
+    if not BEARER_TOKEN:
+        raise MissingConfiguration('the Cortana API bearer token is not configured yet')
+    return BEARER_TOKEN
+
 
+def cortana_headers():
+    """Headers with the bearer token for Cortana API requests"""
+    return {'Authorization': f'Bearer {get_bearer_token()}'}
 
 def setup_ffmpeg():
     """Ensure FFmpeg is available"""
@@ -65,60 +106,1961 @@ def setup_ffmpeg():
         
         return False
 
-# Setup FFmpeg
-setup_ffmpeg()
+_ffmpeg_probe = None
+
+
+async def probe_ffmpeg():
+    """Check for FFmpeg once, off the event loop; later calls reuse the cached result"""
+    global _ffmpeg_probe
+    if _ffmpeg_probe is None:
+        _ffmpeg_probe = asyncio.ensure_future(asyncio.to_thread(setup_ffmpeg))
+    return await _ffmpeg_probe
 
 # Support both DISCORD_SERVER_ID and server_id for backwards compatibility
 GUILD_ID = discord.Object(id=DISCORD_SERVER_ID) if DISCORD_SERVER_ID else None
+# Sharding: SHARD_COUNT=0 uses Discord's recommended count; SHARDS_PER_PROCESS=0 runs every shard in this process
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', '0'))
+SHARDS_PER_PROCESS = int(os.getenv('SHARDS_PER_PROCESS', '0'))
+SHARD_REPORT_INTERVAL = float(os.getenv('SHARD_REPORT_INTERVAL', '15'))
+SHARD_STARTUP_DELAY = 5.0  # seconds per shard between worker starts (IDENTIFY rate limit)
+
+# Hash of the last synced command tree, so restarts skip unchanged syncs
+COMMAND_SYNC_CACHE = os.getenv('COMMAND_SYNC_CACHE', os.path.join('data', 'command_tree.sha256'))
+FORCE_COMMAND_SYNC = env_flag('FORCE_COMMAND_SYNC', False)
+
+
+def command_tree_hash(tree, guild, application_id):
+    """Hash the registered application commands as Discord would receive them"""
+    commands_payload = sorted((command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+                              key=lambda command: command['name'])
+    payload = {
+        'application_id': application_id,
+        'guild_id': guild.id if guild else None,
+        'commands': commands_payload,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
 # cortana_api_url = 'https://wolf1997-cortana-api.hf.space'
 cortana_api_url = CORTANA_API_URL
 # cortana_api_url = os.getenv('CORTANA_API_URL', 'http://localhost:8000')
 
 # Bearer token for Cortana API authentication
 
+# Shared HTTP connection pool settings (Cortana API + Discord CDN)
+HTTP_POOL_LIMIT = int(os.getenv('HTTP_POOL_LIMIT', '100'))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', '20'))
+HTTP_DNS_CACHE_TTL = int(os.getenv('HTTP_DNS_CACHE_TTL', '300'))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '30'))
+
+# Metrics / health server settings
+HTTP_SERVER_ENABLED = env_flag('HTTP_SERVER_ENABLED', True)
+HTTP_SERVER_PORT = int(os.getenv('PORT', '7860'))  # HF spaces typically use port 7860
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram"""
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for bound, count in zip(self.buckets, self.counts):
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {count}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f'{self.name}_sum {self.sum}')
+        lines.append(f'{self.name}_count {self.count}')
+        return lines
+
+
+class Metrics:
+    """Process-wide latency histograms and error counters"""
+
+    def __init__(self):
+        self.histograms = {
+            'chat': Histogram('cortana_chat_request_seconds', 'Round trip of the /chat request'),
+            'download': Histogram('cortana_attachment_download_seconds', 'Attachment download from the Discord CDN'),
+            'transcode': Histogram('cortana_ffmpeg_transcode_seconds', 'FFmpeg transcode jobs'),
+            'image': Histogram('cortana_image_preprocess_seconds', 'Image downscaling jobs in the process pool'),
+        }
+        self.errors = defaultdict(int)  # stage -> count
+
+    def observe(self, name, seconds):
+        self.histograms[name].observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def error(self, stage):
+        self.errors[stage] += 1
+
+
+def render_metric(name, metric_type, description, samples):
+    """Render one metric family; samples is a list of (labels dict, value)"""
+    lines = [f'# HELP {name} {description}', f'# TYPE {name} {metric_type}']
+    for labels, value in samples:
+        label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+        lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+    return lines
+
+
+metrics = Metrics()
+
+
+# Request tracing settings
+TRACE_ENABLED = env_flag('TRACE_ENABLED', True)
+TRACE_FILE = os.getenv('TRACE_FILE', os.path.join('data', 'traces.jsonl'))
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0.1'))  # share of normal requests written
+TRACE_SLOW_THRESHOLD = float(os.getenv('TRACE_SLOW_THRESHOLD', '10'))  # seconds; slower requests are always dumped
+TRACE_MAX_BYTES = int(os.getenv('TRACE_MAX_BYTES', str(10 * 1024 * 1024)))  # rotate the trace file past this
+TRACE_BACKUP_COUNT = int(os.getenv('TRACE_BACKUP_COUNT', '3'))
+
+# The trace of the request being handled; asyncio tasks started from it inherit it
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+class Trace:
+    """Timeline of one handled request: a span per pipeline stage plus request attributes"""
+
+    def __init__(self, name, started=None, **attrs):
+        self.trace_id = os.urandom(8).hex()
+        self.name = name
+        self.attrs = attrs
+        self.started = time.monotonic() if started is None else started
+        self.timestamp = time.time() - (time.monotonic() - self.started)
+        self.duration = None
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time a stage; the yielded dict takes attributes such as payload sizes"""
+        started = time.monotonic()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs['error'] = type(e).__name__
+            raise
+        finally:
+            self.add_span(name, started, time.monotonic(), **attrs)
+
+    def add_span(self, name, started, finished, **attrs):
+        self.spans.append({
+            'name': name,
+            'start': round(started - self.started, 6),
+            'duration': round(finished - started, 6),
+            **({'attrs': attrs} if attrs else {}),
+        })
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'timestamp': self.timestamp,
+            'duration': round(self.duration, 6) if self.duration is not None else None,
+            'attrs': self.attrs,
+            'spans': sorted(self.spans, key=lambda span: span['start']),
+        }
+
+    def format_breakdown(self):
+        lines = [f"🐢 Slow request {self.trace_id} ({self.name}) took {self.duration:.2f}s {self.attrs}"]
+        for span in self.to_dict()['spans']:
+            lines.append(f"   {span['start']:+8.3f}s  {span['name']:<18} {span['duration'] * 1000:9.1f} ms  "
+                         f"{span.get('attrs', '')}")
+        return '\n'.join(lines)
+
+
+@contextmanager
+def trace_span(name, **attrs):
+    """Time a stage of the current request, or do nothing outside a traced request"""
+    trace = current_trace.get()
+    if trace is None:
+        yield attrs
+    else:
+        with trace.span(name, **attrs) as span_attrs:
+            yield span_attrs
+
+
+def trace_mark(name, started, **attrs):
+    """Record a stage of the current request that started at the given time.monotonic() and ends now"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_span(name, started, time.monotonic(), **attrs)
+
+
+def trace_attrs(**attrs):
+    """Attach attributes (payload sizes, errors, ...) to the current request's trace"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+class Tracer:
+    """Writes sampled request traces as JSON lines to a rotating file and dumps slow ones
+
+    File writes happen on a logging QueueListener thread, never on the event loop.
+    """
+
+    def __init__(self, path=TRACE_FILE, sample_rate=TRACE_SAMPLE_RATE, slow_threshold=TRACE_SLOW_THRESHOLD,
+                 max_bytes=TRACE_MAX_BYTES, backup_count=TRACE_BACKUP_COUNT):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._logger = None
+        self._listener = None
+        self.stats = {'traces': 0, 'written': 0, 'slow': 0, 'errors': 0}
+
+    def _get_logger(self):
+        if self._logger is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                self.path, maxBytes=self.max_bytes, backupCount=self.backup_count, encoding='utf-8',
+            )
+            records = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(records, handler)
+            self._listener.start()
+            self._logger = logging.getLogger(f'cortana.traces.{id(self)}')
+            self._logger.propagate = False
+            self._logger.setLevel(logging.INFO)
+            self._logger.addHandler(logging.handlers.QueueHandler(records))
+        return self._logger
+
+    @contextmanager
+    def trace(self, name, started=None, **attrs):
+        """Trace everything that runs inside the block as one request"""
+        if not TRACE_ENABLED:
+            yield None
+            return
+        trace = Trace(name, started, **attrs)
+        token = current_trace.set(trace)
+        try:
+            yield trace
+        except BaseException as e:
+            trace.attrs['error'] = type(e).__name__
+            raise
+        finally:
+            current_trace.reset(token)
+            self.finish(trace)
+
+    def finish(self, trace):
+        trace.duration = time.monotonic() - trace.started
+        self.stats['traces'] += 1
+        slow = trace.duration >= self.slow_threshold
+        if slow:
+            self.stats['slow'] += 1
+            trace.attrs['slow'] = True
+            print(trace.format_breakdown())
+        if 'error' in trace.attrs:
+            self.stats['errors'] += 1
+        if slow or 'error' in trace.attrs or random.random() < self.sample_rate:
+            try:
+                self._get_logger().info(json.dumps(trace.to_dict(), default=str))
+                self.stats['written'] += 1
+            except OSError as e:
+                print(f"⚠️ Could not write trace: {e}")
+
+    def close(self):
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+
+
+tracer = Tracer()
+
+# FFmpeg transcoding worker pool settings
+FFMPEG_MAX_CONCURRENCY = int(os.getenv('FFMPEG_MAX_CONCURRENCY', '2'))
+FFMPEG_TIMEOUT = float(os.getenv('FFMPEG_TIMEOUT', '30'))
+
+
+class TranscodeError(Exception):
+    """Raised when an FFmpeg job fails, times out or FFmpeg is missing"""
+
+
+def fix_wav_header(wav_data):
+    """Patch RIFF/data sizes that FFmpeg cannot seek back to fill when writing to a pipe"""
+    data_pos = wav_data.find(b'data', 12)
+    if not wav_data.startswith(b'RIFF') or data_pos < 0:
+        return wav_data
+    patched = bytearray(wav_data)
+    patched[4:8] = (len(wav_data) - 8).to_bytes(4, 'little')
+    patched[data_pos + 4:data_pos + 8] = (len(wav_data) - data_pos - 8).to_bytes(4, 'little')
+    return bytes(patched)
+
+
+# Audio preprocessing settings (applied to every audio attachment before upload)
+AUDIO_PREPROCESS_ENABLED = env_flag('AUDIO_PREPROCESS_ENABLED', True)
+AUDIO_SAMPLE_RATE = int(os.getenv('AUDIO_SAMPLE_RATE', '16000'))  # speech-model rate
+AUDIO_MAX_DURATION = float(os.getenv('AUDIO_MAX_DURATION', '120'))  # seconds kept per clip, after trimming
+AUDIO_TRIM_SILENCE = env_flag('AUDIO_TRIM_SILENCE', True)
+AUDIO_SILENCE_THRESHOLD_DB = float(os.getenv('AUDIO_SILENCE_THRESHOLD_DB', '-50'))
+# wav works with any backend; only switch to flac or opus if the Cortana API accepts them
+AUDIO_OUTPUT_CODEC = os.getenv('AUDIO_OUTPUT_CODEC', 'wav').lower()
+AUDIO_OPUS_BITRATE = os.getenv('AUDIO_OPUS_BITRATE', '24k')
+
+# codec -> (FFmpeg muxer, content type, file extension, encoder arguments)
+AUDIO_CODECS = {
+    'wav': ('wav', 'audio/wav', '.wav', ()),
+    'flac': ('flac', 'audio/flac', '.flac', ('-c:a', 'flac', '-compression_level', '8')),
+    'opus': ('ogg', 'audio/ogg', '.ogg', ('-c:a', 'libopus', '-b:a', AUDIO_OPUS_BITRATE, '-application', 'voip')),
+}
+if AUDIO_OUTPUT_CODEC not in AUDIO_CODECS:
+    print(f"⚠️ Unknown AUDIO_OUTPUT_CODEC {AUDIO_OUTPUT_CODEC!r}, using wav")
+    AUDIO_OUTPUT_CODEC = 'wav'
+
+
+def speech_filter_args(sample_rate=AUDIO_SAMPLE_RATE, trim_silence=AUDIO_TRIM_SILENCE,
+                       threshold_db=AUDIO_SILENCE_THRESHOLD_DB, max_duration=AUDIO_MAX_DURATION):
+    """FFmpeg output arguments that downmix, resample, trim leading/trailing silence and cap the clip length
+
+    Downmixing and resampling come first so the later filters see as few samples as possible, and
+    the cap comes before areverse, which buffers its whole input in memory.
+    """
+    filters = ['aformat=channel_layouts=mono', f'aresample={sample_rate}']
+    # silenceremove only trims the start, so run it again on the reversed clip for the end
+    trim = f'silenceremove=start_periods=1:start_threshold={threshold_db}dB:start_silence=0.1'
+    if trim_silence:
+        filters.append(trim)
+    if max_duration:
+        filters.append(f'atrim=duration={max_duration}')
+    if trim_silence:
+        filters += ['areverse', trim, 'areverse']
+    return ['-af', ','.join(filters)]
+
+
+class FFmpegTranscoder:
+    """Async FFmpeg worker pool that pipes audio through stdin/stdout"""
+
+    def __init__(self, max_concurrency=FFMPEG_MAX_CONCURRENCY, timeout=FFMPEG_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.queue_depth = 0
+        self.running = 0
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'timeouts': 0,
+            'peak_queue_depth': 0,
+        }
+
+    async def transcode(self, data, output_format='wav', sample_rate=16000, channels=1, extra_args=()):
+        """Transcode raw audio bytes and return the encoded output bytes"""
+        if not await probe_ffmpeg():
+            raise TranscodeError('FFmpeg not found in PATH')
+        args = [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-i', 'pipe:0',
+            '-ar', str(sample_rate),  # sample rate
+            '-ac', str(channels),     # channel count
+            *extra_args,
+            '-f', output_format,
+            'pipe:1',
+        ]
+
+        self.stats['submitted'] += 1
+        self.queue_depth += 1
+        self.stats['peak_queue_depth'] = max(self.stats['peak_queue_depth'], self.queue_depth)
+        try:
+            with trace_span('ffmpeg_wait'):
+                await self._semaphore.acquire()
+        finally:
+            self.queue_depth -= 1
+
+        self.running += 1
+        try:
+            with metrics.timer('transcode'), trace_span('ffmpeg', input_bytes=len(data)) as span:
+                output = await self._run(args, data)
+                span['output_bytes'] = len(output)
+            self.stats['completed'] += 1
+            return output
+        except Exception:
+            self.stats['failed'] += 1
+            metrics.error('transcode')
+            raise
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+
+    async def preprocess_speech(self, data, codec=AUDIO_OUTPUT_CODEC, sample_rate=AUDIO_SAMPLE_RATE):
+        """Trim, downmix, resample and re-encode a voice clip for upload
+
+        Returns the encoded bytes and the clip's new content type and extension.
+        """
+        output_format, content_type, extension, codec_args = AUDIO_CODECS[codec]
+        output = await self.transcode(data, output_format, sample_rate, 1,
+                                      extra_args=(*speech_filter_args(sample_rate), *codec_args))
+        if output_format == 'wav':
+            output = fix_wav_header(output)
+        return output, content_type, extension
+
+    async def _run(self, args, data):
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *args,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+        except FileNotFoundError:
+            raise TranscodeError('FFmpeg not found in PATH')
+
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(data), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            process.kill()
+            await process.wait()
+            raise TranscodeError(f'FFmpeg timed out after {self.timeout}s')
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+
+        if process.returncode != 0:
+            error = stderr.decode(errors='replace').strip()
+            raise TranscodeError(error or f'FFmpeg exited with code {process.returncode}')
+        return stdout
+
+
+# Voice playback settings
+# Let FFmpeg read the TTS URL directly and reconnect on dropped streams
+FFMPEG_STREAM_BEFORE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+PLAYBACK_QUEUE_MAX_SIZE = int(os.getenv('PLAYBACK_QUEUE_MAX_SIZE', '10'))
+
+
+class StreamedClip:
+    """File-like source for FFmpegPCMAudio(pipe=True) that is fed chunks while they download
+
+    read() runs on discord.py's pipe writer thread and blocks until the next chunk arrives.
+    """
+
+    def __init__(self):
+        self._chunks = queue.SimpleQueue()
+        self._buffer = b''
+
+    def feed(self, chunk):
+        if chunk:
+            self._chunks.put(chunk)
+
+    def close(self):
+        self._chunks.put(b'')  # end of stream
+
+    def read(self, size=-1):
+        if not self._buffer:
+            self._buffer = self._chunks.get()
+            if not self._buffer:
+                self._chunks.put(b'')  # keep later reads at end of stream
+                return b''
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class VoicePlaybackQueue:
+    """Per-guild FIFO of audio clips, streamed one after another"""
+
+    def __init__(self, guild, source_factory, max_size=PLAYBACK_QUEUE_MAX_SIZE):
+        self.guild = guild
+        self.source_factory = source_factory  # async callable: audio_url -> AudioSource
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.now_playing = None
+        self._worker = None
+
+    @property
+    def depth(self):
+        return self.queue.qsize() + (1 if self.now_playing else 0)
+
+    def enqueue(self, audio_url):
+        """Add a clip to the queue and return the number of clips ahead of it"""
+        position = self.depth
+        self.queue.put_nowait(audio_url)  # raises asyncio.QueueFull when saturated
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        return position
+
+    def clear(self):
+        """Drop pending clips and stop the current one"""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        voice_client = self.guild.voice_client
+        if voice_client and voice_client.is_playing():
+            voice_client.stop()
+
+    async def _run(self):
+        while not self.queue.empty():
+            self.now_playing = self.queue.get_nowait()
+            try:
+                await self._play(self.now_playing)
+            except Exception as e:
+                metrics.error('playback')
+                print(f"Error playing audio response: {e}")
+            finally:
+                self.now_playing = None
+
+    async def _play(self, audio_url):
+        voice_client = self.guild.voice_client
+        if not voice_client or not voice_client.is_connected():
+            return
+
+        loop = asyncio.get_running_loop()
+        finished = asyncio.Event()
+
+        def after(error):
+            # Called from the voice thread once playback ends
+            if error:
+                print(f"Error during voice playback: {error}")
+            loop.call_soon_threadsafe(finished.set)
+
+        source = await self.source_factory(audio_url)
+        voice_client.play(source, after=after)
+        await finished.wait()
+
+
+# Real-time voice capture settings (needs the optional discord-ext-voice-recv package)
+try:
+    from discord.ext import voice_recv
+except ImportError:
+    voice_recv = None
+
+DISCORD_PCM_RATE = 48000  # decoded Opus from Discord is 48 kHz stereo s16le
+SPEECH_SAMPLE_RATE = 16000
+VAD_ENERGY_THRESHOLD = float(os.getenv('VAD_ENERGY_THRESHOLD', '500'))  # RMS of 16-bit samples
+VAD_SILENCE_MS = int(os.getenv('VAD_SILENCE_MS', '800'))  # silence that ends an utterance
+VAD_MIN_UTTERANCE_MS = int(os.getenv('VAD_MIN_UTTERANCE_MS', '400'))
+VAD_MAX_UTTERANCE_SECONDS = float(os.getenv('VAD_MAX_UTTERANCE_SECONDS', '30'))  # per-speaker buffer bound
+VAD_PREROLL_MS = int(os.getenv('VAD_PREROLL_MS', '200'))  # audio kept from before speech starts
+VAD_FRAME_MS = 20
+
+
+def downsample_to_speech(pcm):
+    """Convert 48 kHz stereo s16le PCM to 16 kHz mono samples
+
+    Each output sample averages three stereo frames, which also acts as a
+    simple low-pass filter before decimation.
+    """
+    samples = array('h')
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % 12])
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return array('h', (sum(samples[i:i + 6]) // 6 for i in range(0, len(samples), 6)))
+
+
+def rms(samples):
+    if not samples:
+        return 0.0
+    return math.sqrt(sum(sample * sample for sample in samples) / len(samples))
+
+
+def encode_wav(samples, sample_rate=SPEECH_SAMPLE_RATE):
+    """Encode mono 16-bit samples as a WAV file"""
+    if sys.byteorder == 'big':
+        samples = array('h', samples)
+        samples.byteswap()
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+class SpeakerBuffer:
+    """Audio state of one speaker: pre-roll while quiet, the utterance while speaking"""
+
+    def __init__(self, preroll_frames):
+        self.preroll = deque(maxlen=preroll_frames)
+        self.samples = array('h')
+        self.speaking = False
+        self.started = 0.0
+        self.last_voice = 0.0
+        self.last_packet = 0.0
+
+
+class VoiceSegmenter:
+    """Energy-based voice activity detection that splits each speaker's audio into utterances
+
+    feed() is called with decoded PCM from the voice receive thread, and
+    flush_idle() periodically from the event loop, since Discord stops sending
+    packets while someone is silent. Finished utterances are passed to
+    on_utterance(speaker_id, wav_bytes) as 16 kHz mono WAV.
+    """
+
+    def __init__(self, on_utterance, threshold=VAD_ENERGY_THRESHOLD, silence_ms=VAD_SILENCE_MS,
+                 min_utterance_ms=VAD_MIN_UTTERANCE_MS, max_utterance_seconds=VAD_MAX_UTTERANCE_SECONDS,
+                 preroll_ms=VAD_PREROLL_MS):
+        self.on_utterance = on_utterance
+        self.threshold = threshold
+        self.silence = silence_ms / 1000
+        self.min_utterance = min_utterance_ms / 1000
+        self.max_samples = int(max_utterance_seconds * SPEECH_SAMPLE_RATE)
+        self.preroll_frames = max(1, preroll_ms // VAD_FRAME_MS)
+        self._speakers = {}
+        self._lock = threading.Lock()
+        self.stats = {'frames': 0, 'voiced_frames': 0, 'utterances': 0, 'discarded': 0, 'truncated': 0}
+
+    def feed(self, speaker_id, pcm, now=None):
+        """Add one frame of 48 kHz stereo PCM from a speaker"""
+        now = time.monotonic() if now is None else now
+        frame = downsample_to_speech(pcm)
+        voiced = rms(frame) >= self.threshold
+        finished = None
+        with self._lock:
+            self.stats['frames'] += 1
+            buffer = self._speakers.get(speaker_id)
+            if buffer is None:
+                buffer = self._speakers[speaker_id] = SpeakerBuffer(self.preroll_frames)
+            buffer.last_packet = now
+            if voiced:
+                self.stats['voiced_frames'] += 1
+                if not buffer.speaking:
+                    buffer.speaking = True
+                    buffer.started = now
+                    for preroll_frame in buffer.preroll:
+                        buffer.samples.extend(preroll_frame)
+                    buffer.preroll.clear()
+                buffer.last_voice = now
+            if buffer.speaking:
+                buffer.samples.extend(frame)
+                if len(buffer.samples) >= self.max_samples:
+                    self.stats['truncated'] += 1
+                    finished = self._finish(buffer)
+            else:
+                buffer.preroll.append(frame)
+        if finished:
+            self.on_utterance(speaker_id, finished)
+
+    def flush_idle(self, now=None):
+        """End utterances of speakers that have been silent long enough"""
+        now = time.monotonic() if now is None else now
+        finished = []
+        with self._lock:
+            for speaker_id, buffer in list(self._speakers.items()):
+                if buffer.speaking and now - buffer.last_voice >= self.silence:
+                    wav_data = self._finish(buffer)
+                    if wav_data:
+                        finished.append((speaker_id, wav_data))
+                elif not buffer.speaking and now - buffer.last_packet >= 60:
+                    # Forget speakers who left or went quiet
+                    del self._speakers[speaker_id]
+        for speaker_id, wav_data in finished:
+            self.on_utterance(speaker_id, wav_data)
+
+    def _finish(self, buffer):
+        samples = buffer.samples
+        buffer.samples = array('h')
+        buffer.speaking = False
+        if buffer.last_voice - buffer.started + VAD_FRAME_MS / 1000 < self.min_utterance:
+            self.stats['discarded'] += 1
+            return None
+        self.stats['utterances'] += 1
+        return encode_wav(samples)
+
+
+class VoiceUtterance:
+    """A finished utterance, shaped like a discord.Message so it shares the scheduler with text messages"""
+
+    def __init__(self, guild, channel, author, wav_data):
+        self.guild = guild
+        self.channel = channel  # text channel the replies go to
+        self.author = author
+        self.wav_data = wav_data
+        self.content = ''
+        self.attachments = []
+
+
+class VoiceListener:
+    """Receives a guild's voice channel audio and queues finished utterances with the bot's scheduler"""
+
+    def __init__(self, client, guild, text_channel):
+        self.client = client
+        self.guild = guild
+        self.text_channel = text_channel
+        self.segmenter = VoiceSegmenter(self._on_utterance)
+        self.speakers = {}  # user id -> member, for replies
+        self._loop = asyncio.get_running_loop()
+        self._watchdog = None
+
+    def start(self, voice_client):
+        # Opus is decoded by voice_recv's reader thread, so write() never runs on the event loop
+        voice_client.listen(voice_recv.BasicSink(self.write))
+        self._watchdog = asyncio.create_task(self._watch())
+
+    def stop(self):
+        voice_client = self.guild.voice_client
+        if voice_client and hasattr(voice_client, 'stop_listening'):
+            voice_client.stop_listening()
+        if self._watchdog:
+            self._watchdog.cancel()
+
+    def is_active(self):
+        voice_client = self.guild.voice_client
+        return voice_client is not None and voice_client.is_connected() and voice_client.is_listening()
+
+    def write(self, user, data):
+        if user is None or user.bot or not data.pcm:
+            return
+        self.speakers[user.id] = user
+        self.segmenter.feed(user.id, data.pcm)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(VAD_FRAME_MS * 5 / 1000)
+            if self.guild.voice_client is None:
+                # Disconnected without /leave_voice (kicked, moved out, connection lost)
+                self.client.stop_listening(self.guild)
+                return
+            self.segmenter.flush_idle()
+
+    def _on_utterance(self, speaker_id, wav_data):
+        # May be called from the voice receive thread
+        self._loop.call_soon_threadsafe(self._dispatch, speaker_id, wav_data)
+
+    def _dispatch(self, speaker_id, wav_data):
+        member = self.speakers.get(speaker_id)
+        if member is None:
+            return
+        # Same lane as the speaker's text messages: ordered per session, bounded globally
+        utterance = VoiceUtterance(self.guild, self.text_channel, member, wav_data)
+        if not self.client.scheduler.submit(utterance, handler=self.client.handle_utterances):
+            self.client.create_background_task(self.text_channel.send(
+                f'{member.mention}, ⏳ I\'m busy right now, please try again in a moment.'
+            ))
+
+
+# Reply streaming settings
+STREAM_REPLIES = env_flag('CORTANA_STREAM_REPLIES', False)
+STREAM_EDIT_INTERVAL = float(os.getenv('STREAM_EDIT_INTERVAL', '1.0'))  # seconds between message edits
+STREAM_CONTENT_TYPES = ('text/event-stream', 'application/x-ndjson')
+STREAM_DELTA_KEYS = ('delta', 'token', 'content')
+DISCORD_MESSAGE_LIMIT = 2000
+STREAM_INTERRUPTED = ' … *(reply interrupted)*'
+STREAM_CURSOR = ' ▌'
+
+
+def split_message(text, limit=DISCORD_MESSAGE_LIMIT):
+    """Split text into Discord-sized chunks, preferring line and word boundaries"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind('\n', limit // 2, limit)
+        if cut < 0:
+            cut = text.rfind(' ', limit // 2, limit)
+        if cut < 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip('\n ')
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+
+def parse_stream_payload(payload):
+    """Decode one streamed payload: JSON objects become dicts, anything else stays text"""
+    try:
+        decoded = json.loads(payload)
+    except json.JSONDecodeError:
+        return payload
+    if isinstance(decoded, dict):
+        return decoded
+    return decoded if isinstance(decoded, str) else payload
+
+
+async def iter_stream_events(resp):
+    """Yield payloads from a server-sent-event or newline-delimited JSON response"""
+    is_sse = resp.content_type == 'text/event-stream'
+    data_lines = []
+    async for raw_line in resp.content:
+        line = raw_line.decode('utf-8', errors='replace').rstrip('\r\n')
+        if not is_sse:
+            if line.strip():
+                yield parse_stream_payload(line)
+            continue
+
+        if line:
+            # Only data: fields carry payload; event:, id:, retry: and comments are skipped
+            if line.startswith('data:'):
+                value = line[5:]
+                data_lines.append(value[1:] if value.startswith(' ') else value)
+            continue
+
+        # A blank line terminates the event
+        if not data_lines:
+            continue
+        payload = '\n'.join(data_lines)
+        data_lines = []
+        if payload.strip() == '[DONE]':
+            return
+        yield parse_stream_payload(payload)
 
-class Client(commands.Bot):
+    if data_lines and '\n'.join(data_lines).strip() != '[DONE]':
+        yield parse_stream_payload('\n'.join(data_lines))
+
+
+class StreamingReply:
+    """Discord reply that is edited progressively as text streams in"""
+
+    def __init__(self, channel, prefix='', edit_interval=STREAM_EDIT_INTERVAL):
+        self.channel = channel
+        self.prefix = prefix
+        self.edit_interval = edit_interval
+        self.text = ''
+        self.messages = []
+        self._rendered = []
+        self._last_edit = 0.0
+
+    async def start(self):
+        """Post the placeholder message"""
+        await self._render([self.prefix + STREAM_CURSOR.strip()])
+
+    async def append(self, delta):
+        self.text += delta
+        # Throttle edits to stay within Discord's per-channel edit rate limit
+        if time.monotonic() - self._last_edit >= self.edit_interval:
+            await self.flush()
+
+    async def flush(self, final=False):
+        # Split the same way with or without the cursor, so the final edit never needs fewer messages
+        chunks = split_message(self.prefix + self.text, DISCORD_MESSAGE_LIMIT - len(STREAM_CURSOR))
+        if not final:
+            chunks[-1] += STREAM_CURSOR
+        await self._render(chunks)
+
+    async def _render(self, chunks):
+        for i, chunk in enumerate(chunks):
+            if i < len(self.messages):
+                if self._rendered[i] != chunk:
+                    await self.messages[i].edit(content=chunk)
+                    self._rendered[i] = chunk
+            else:
+                # Overflow past the message limit into a follow-up message
+                self.messages.append(await self.channel.send(chunk))
+                self._rendered.append(chunk)
+        for message in self.messages[len(chunks):]:
+            await message.delete()
+        del self.messages[len(chunks):], self._rendered[len(chunks):]
+        self._last_edit = time.monotonic()
+
+
+# Attachment ingestion settings
+ATTACHMENT_MAX_BYTES = int(os.getenv('ATTACHMENT_MAX_BYTES', str(25 * 1024 * 1024)))
+MESSAGE_ATTACHMENTS_MAX_BYTES = int(os.getenv('MESSAGE_ATTACHMENTS_MAX_BYTES', str(50 * 1024 * 1024)))
+ATTACHMENT_DOWNLOAD_CONCURRENCY = int(os.getenv('ATTACHMENT_DOWNLOAD_CONCURRENCY', '4'))
+ATTACHMENT_SPOOL_THRESHOLD = int(os.getenv('ATTACHMENT_SPOOL_THRESHOLD', str(1024 * 1024)))  # spill to disk past this
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+
+
+class AttachmentTooLarge(Exception):
+    """Raised when an attachment or a message's attachments exceed the size caps"""
+
+
+def format_size(num_bytes):
+    return f'{num_bytes / (1024 * 1024):.1f} MB'
+
+
+def payload_size(file_data):
+    """Size of an upload given as bytes or as a seekable file"""
+    if isinstance(file_data, (bytes, bytearray)):
+        return len(file_data)
+    position = file_data.tell()
+    size = file_data.seek(0, io.SEEK_END)
+    file_data.seek(position)
+    return size
+
+
+def check_attachment_sizes(attachments):
+    """Reject oversized attachments using the sizes Discord reports, before downloading"""
+    for attachment in attachments:
+        if attachment.size > ATTACHMENT_MAX_BYTES:
+            raise AttachmentTooLarge(
+                f'{attachment.filename} is too large ({format_size(attachment.size)}, '
+                f'limit {format_size(ATTACHMENT_MAX_BYTES)})'
+            )
+    total = sum(attachment.size for attachment in attachments)
+    if total > MESSAGE_ATTACHMENTS_MAX_BYTES:
+        raise AttachmentTooLarge(
+            f'attachments are too large in total ({format_size(total)}, '
+            f'limit {format_size(MESSAGE_ATTACHMENTS_MAX_BYTES)})'
+        )
+
+
+# Image preprocessing settings (needs the optional Pillow package)
+try:
+    import image_worker
+except ImportError:
+    image_worker = None
+
+IMAGE_PREPROCESS_ENABLED = env_flag('IMAGE_PREPROCESS_ENABLED', True)
+IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', '2048'))  # longest side in pixels
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', str(4_000_000)))
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'jpeg').lower()  # jpeg or webp
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '85'))
+IMAGE_PASSTHROUGH_BYTES = int(os.getenv('IMAGE_PASSTHROUGH_BYTES', str(512 * 1024)))  # small images are sent as is
+MESSAGE_IMAGES_MAX_BYTES = int(os.getenv('MESSAGE_IMAGES_MAX_BYTES', str(8 * 1024 * 1024)))  # after processing
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))
+
+# format -> (Pillow format, content type, file extension)
+IMAGE_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg'),
+    'webp': ('WEBP', 'image/webp', '.webp'),
+}
+if IMAGE_FORMAT not in IMAGE_FORMATS:
+    print(f"⚠️ Unknown IMAGE_FORMAT {IMAGE_FORMAT!r}, using jpeg")
+    IMAGE_FORMAT = 'jpeg'
+
+
+@contextmanager
+def spawning_main(module):
+    """Make processes started in this block run `module` as their main module
+
+    The spawn start method re-imports the parent's __main__ in every child, which
+    for discord_bot.py would load the whole bot into each image worker.
+    """
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = module
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
+
+
+class ImageProcessor:
+    """Process pool that downsizes image attachments away from the event loop"""
+
+    def __init__(self, workers=IMAGE_WORKERS):
+        self.workers = workers
+        self._pool = None
+        self.stats = {
+            'processed': 0,
+            'passthrough': 0,
+            'failed': 0,
+            'bytes_in': 0,
+            'bytes_out': 0,
+        }
+
+    def _get_pool(self):
+        # Started on first use; spawn avoids forking the running event loop and gateway threads
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context('spawn'),
+            )
+        return self._pool
+
+    async def shrink(self, data, max_bytes):
+        """Return the processed image bytes, or None to send the original"""
+        loop = asyncio.get_running_loop()
+        try:
+            with metrics.timer('image'):
+                # Workers are started on demand inside submit(), which run_in_executor calls right away
+                with spawning_main(image_worker):
+                    future = loop.run_in_executor(
+                        self._get_pool(), image_worker.shrink_image, data, max_bytes,
+                        IMAGE_FORMATS[IMAGE_FORMAT][0], IMAGE_QUALITY, IMAGE_MAX_SIDE, IMAGE_MAX_PIXELS,
+                        IMAGE_PASSTHROUGH_BYTES,
+                    )
+                output = await future
+        except concurrent.futures.process.BrokenProcessPool:
+            # A worker crashed (e.g. out of memory); start a fresh pool for the next image
+            self._pool = None
+            raise
+        except Exception:
+            self.stats['failed'] += 1
+            metrics.error('image')
+            raise
+
+        self.stats['bytes_in'] += len(data)
+        if output is None:
+            self.stats['passthrough'] += 1
+            self.stats['bytes_out'] += len(data)
+        else:
+            self.stats['processed'] += 1
+            self.stats['bytes_out'] += len(output)
+        return output
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Media cache settings (preprocessed speech and images, keyed by content, and TTS audio)
+CACHE_ENABLED = env_flag('CACHE_ENABLED', True)
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.join('data', 'cache'))
+CACHE_MEMORY_BYTES = int(os.getenv('CACHE_MEMORY_BYTES', str(64 * 1024 * 1024)))
+CACHE_DISK_BYTES = int(os.getenv('CACHE_DISK_BYTES', str(1024 * 1024 * 1024)))
+CACHE_MAX_ITEM_BYTES = int(os.getenv('CACHE_MAX_ITEM_BYTES', str(16 * 1024 * 1024)))
+
+
+def cache_key(kind, identity, **params):
+    """Build a cache key from the item kind, its identity (id, URL or content hash) and parameters"""
+    parts = [kind, str(identity)] + [f'{name}={params[name]}' for name in sorted(params)]
+    return hashlib.sha256('|'.join(parts).encode()).hexdigest()
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_and_hash(file_data):
+    """Read a downloaded attachment (possibly spooled to disk) and hash it; blocking, so run it in a thread"""
+    data = file_data.read()
+    return data, content_hash(data)
+
+
+class MediaCache:
+    """Two-tier cache: an in-memory LRU in front of a byte-budgeted on-disk store"""
+
+    def __init__(self, directory=CACHE_DIR, memory_bytes=CACHE_MEMORY_BYTES,
+                 disk_bytes=CACHE_DISK_BYTES, max_item_bytes=CACHE_MAX_ITEM_BYTES):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.max_item_bytes = max_item_bytes
+        self._memory = OrderedDict()  # key -> bytes, least recently used first
+        self._memory_size = 0
+        self._disk = OrderedDict()  # key -> size on disk, least recently used first
+        self._disk_size = 0
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0,
+            'skipped_too_large': 0,
+        }
+
+    def load(self):
+        """Index the on-disk store, oldest first (blocking; run in a thread)"""
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        self._evict_disk()
+        print(f"✅ Media cache ready ({len(self._disk)} files, {format_size(self._disk_size)} on disk)")
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _remember(self, key, data):
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+            self.stats['memory_evictions'] += 1
+
+    def _evict_disk(self):
+        while self._disk_size > self.disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            self.stats['disk_evictions'] += 1
+            try:
+                os.unlink(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def _read_file(self, key):
+        path = self._path(key)
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)  # keep recency across restarts
+        return data
+
+    def _write_file(self, key, data):
+        # A unique temp name, so concurrent writers of the same key never rename a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    async def get(self, key):
+        """Return cached bytes for a key, or None on a miss"""
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            self.stats['memory_hits'] += 1
+            return data
+
+        if key in self._disk:
+            try:
+                data = await asyncio.to_thread(self._read_file, key)
+            except FileNotFoundError:
+                self._disk_size -= self._disk.pop(key, 0)
+            else:
+                self._disk.move_to_end(key)
+                self._remember(key, data)
+                self.stats['disk_hits'] += 1
+                return data
+
+        self.stats['misses'] += 1
+        return None
+
+    async def put(self, key, data):
+        """Store bytes in both tiers; items over max_item_bytes are not cached"""
+        if len(data) > self.max_item_bytes:
+            self.stats['skipped_too_large'] += 1
+            return
+        self._remember(key, data)
+        try:
+            await asyncio.to_thread(self._write_file, key, data)
+        except OSError as e:
+            print(f"⚠️ Could not write cache entry: {e}")
+            return
+        self._disk_size -= self._disk.pop(key, 0)
+        self._disk[key] = len(data)
+        self._disk_size += len(data)
+        self._evict_disk()
+
+
+# Conversation session settings
+# Which Cortana conversation a message belongs to:
+#   user          one conversation per user, wherever they talk to the bot
+#   channel_user  one per user in each channel (default)
+#   channel       one shared conversation per channel
+#   guild         one shared conversation per server
+SESSION_SCOPE = os.getenv('SESSION_SCOPE', 'channel_user').lower()
+SESSION_IDLE_TIMEOUT = float(os.getenv('SESSION_IDLE_TIMEOUT', str(60 * 60)))  # forget sessions idle this long
+SESSION_MAX = int(os.getenv('SESSION_MAX', '10000'))  # sessions tracked at once, least recently used dropped first
+SESSION_SCOPES = ('user', 'channel_user', 'channel', 'guild')
+if SESSION_SCOPE not in SESSION_SCOPES:
+    print(f"⚠️ Unknown SESSION_SCOPE {SESSION_SCOPE!r}, using channel_user")
+    SESSION_SCOPE = 'channel_user'
+
+
+def session_key(guild_id, channel_id, user_id, scope=SESSION_SCOPE):
+    """Identify a Cortana conversation from where and by whom a message was sent"""
+    if scope == 'user':
+        return (None, None, user_id)
+    if scope == 'channel':
+        return (guild_id, channel_id, None)
+    if scope == 'guild':
+        # Direct messages have no guild, so fall back to the channel
+        return (guild_id, None, None) if guild_id is not None else (None, channel_id, None)
+    return (guild_id, channel_id, user_id)
+
+
+class Session:
+    """A Cortana conversation and when it was last used"""
+
+    def __init__(self, key):
+        self.key = key
+        # Stable across restarts, so the backend keeps the conversation's context
+        guild_id, channel_id, user_id = key
+        parts = [f'{prefix}{value}' for prefix, value in (('g', guild_id), ('c', channel_id), ('u', user_id))
+                 if value is not None]
+        self.session_id = 'discord:' + ':'.join(parts)
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.requests = 0
+
+
+class SessionRegistry:
+    """LRU registry of active conversation sessions with idle eviction and a size bound"""
+
+    def __init__(self, max_sessions=SESSION_MAX, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions = OrderedDict()  # key -> Session, least recently used first
+        self.stats = {
+            'created': 0,
+            'evicted_idle': 0,
+            'evicted_full': 0,
+            'resets': 0,
+        }
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, key):
+        """Return the session for a key, creating it if needed, and mark it as used"""
+        now = time.monotonic()
+        self.evict_idle(now)
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._sessions[key] = Session(key)
+            self.stats['created'] += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.stats['evicted_full'] += 1
+        else:
+            self._sessions.move_to_end(key)
+        session.last_used = now
+        session.requests += 1
+        return session
+
+    def reset(self, key):
+        """Forget a session; its next message starts with fresh local state"""
+        self.stats['resets'] += 1
+        return self._sessions.pop(key, None)
+
+    def evict_idle(self, now=None):
+        now = time.monotonic() if now is None else now
+        # Sessions are kept in last-used order, so only the front can be idle
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used < self.idle_timeout:
+                break
+            self._sessions.popitem(last=False)
+            self.stats['evicted_idle'] += 1
+
+
+# Request scheduler settings
+SCHEDULER_MAX_CONCURRENCY = int(os.getenv('SCHEDULER_MAX_CONCURRENCY', '4'))  # conversations handled at once
+SCHEDULER_MAX_PENDING = int(os.getenv('SCHEDULER_MAX_PENDING', '50'))  # queued messages across all conversations
+SCHEDULER_MAX_PENDING_PER_CONVERSATION = int(os.getenv('SCHEDULER_MAX_PENDING_PER_CONVERSATION', '5'))  # messages
+# Seconds to wait for follow-up messages, only while the conversation already has a request running
+SCHEDULER_DEBOUNCE = float(os.getenv('SCHEDULER_DEBOUNCE', '0.25'))
+SCHEDULER_MAX_DEBOUNCE = float(os.getenv('SCHEDULER_MAX_DEBOUNCE', '2'))  # follow-ups can't delay a batch longer
+
+
+def conversation_key(message):
+    """Identify the conversation a message belongs to"""
+    guild_id = message.guild.id if message.guild else None
+    return session_key(guild_id, message.channel.id, message.author.id)
+
+
+class MessageBatch:
+    """Messages from one user in one channel that will be sent as a single request"""
+
+    def __init__(self, message, deadline, latest_deadline, handler=None):
+        self.author_id = message.author.id
+        # User- and guild-scoped sessions span channels, but a batch is answered in one channel
+        self.channel_id = message.channel.id
+        self.messages = [message]
+        self.deadline = deadline
+        self.latest_deadline = latest_deadline
+        self.handler = handler  # None for the scheduler's default handler
+        self.created = time.monotonic()
+
+
+class RequestScheduler:
+    """Orders requests per conversation, coalesces rapid messages and bounds concurrency
+
+    Batches within a conversation run in order; different conversations run
+    in parallel up to max_concurrency. While a conversation has a request
+    running, back-to-back messages from the same user in the same channel
+    arriving within the debounce window are merged into one batch; a message to an idle
+    conversation is dispatched immediately.
+    """
+
+    def __init__(self, handler, max_concurrency=SCHEDULER_MAX_CONCURRENCY,
+                 max_pending=SCHEDULER_MAX_PENDING,
+                 max_pending_per_conversation=SCHEDULER_MAX_PENDING_PER_CONVERSATION,
+                 debounce=SCHEDULER_DEBOUNCE, max_debounce=SCHEDULER_MAX_DEBOUNCE, key_func=conversation_key):
+        self.handler = handler
+        self.max_pending = max_pending
+        self.max_pending_per_conversation = max_pending_per_conversation
+        self.debounce = debounce
+        self.max_debounce = max_debounce
+        self.key_func = key_func
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._conversations = {}  # key -> deque of MessageBatch waiting to run
+        self._workers = {}  # key -> worker task
+        self.pending = 0
+        self.in_flight = 0
+        self.stats = {
+            'submitted': 0,
+            'coalesced': 0,
+            'rejected': 0,
+            'completed': 0,
+            'failed': 0,
+        }
+
+    def submit(self, message, handler=None):
+        """Queue a message; returns False if the scheduler is too busy to accept it
+
+        Items given their own handler (such as voice utterances) share the
+        conversation's lane but are never merged with other messages.
+        """
+        if self.pending >= self.max_pending:
+            self.stats['rejected'] += 1
+            return False
+
+        key = self.key_func(message)
+        batches = self._conversations.setdefault(key, deque())
+        # Coalesced messages count too, so one fast typist can't take every pending slot
+        if sum(len(batch.messages) for batch in batches) >= self.max_pending_per_conversation:
+            self.stats['rejected'] += 1
+            return False
+
+        now = asyncio.get_running_loop().time()
+        worker = self._workers.get(key)
+        # Waiting for follow-ups is free while an earlier request is still running; otherwise it is pure latency
+        busy = worker is not None and not worker.done()
+        debounce = self.debounce if busy else 0.0
+
+        last = batches[-1] if batches else None
+        if (last and handler is None and last.handler is None
+                and last.author_id == message.author.id and last.channel_id == message.channel.id
+                and now < last.deadline):
+            # Merge into the batch that hasn't started yet
+            last.messages.append(message)
+            last.deadline = min(now + self.debounce, last.latest_deadline)
+            self.stats['coalesced'] += 1
+        else:
+            batches.append(MessageBatch(message, now + debounce, now + self.max_debounce, handler))
+
+        self.pending += 1
+        self.stats['submitted'] += 1
+        if not busy:
+            self._workers[key] = asyncio.create_task(self._drain(key))
+        return True
+
+    async def _drain(self, key):
+        batches = self._conversations[key]
+        loop = asyncio.get_running_loop()
+        try:
+            while batches:
+                batch = batches[0]
+                # Wait until no follow-up message has arrived for a full debounce window
+                while (delay := batch.deadline - loop.time()) > 0:
+                    await asyncio.sleep(delay)
+                batches.popleft()
+                self.pending -= len(batch.messages)
+
+                async with self._semaphore:
+                    self.in_flight += 1
+                    try:
+                        # The trace starts when the first message arrived, so it includes the queueing delay
+                        with tracer.trace('message', started=batch.created, messages=len(batch.messages)):
+                            trace_mark('queue', batch.created)
+                            await (batch.handler or self.handler)(batch.messages)
+                        self.stats['completed'] += 1
+                    except Exception as e:
+                        self.stats['failed'] += 1
+                        print(f"Error handling request: {e}")
+                    finally:
+                        self.in_flight -= 1
+        finally:
+            if not batches:
+                self._conversations.pop(key, None)
+                self._workers.pop(key, None)
+
+    async def close(self):
+        """Cancel queued and running work"""
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+
+# Cortana API resilience settings
+CORTANA_CONNECT_TIMEOUT = float(os.getenv('CORTANA_CONNECT_TIMEOUT', '10'))
+CORTANA_READ_TIMEOUT = float(os.getenv('CORTANA_READ_TIMEOUT', '60'))  # max gap between received chunks
+CORTANA_TOTAL_TIMEOUT = float(os.getenv('CORTANA_TOTAL_TIMEOUT', '180'))
+CORTANA_MAX_RETRIES = int(os.getenv('CORTANA_MAX_RETRIES', '3'))  # idempotent calls only
+CORTANA_RETRY_BASE_DELAY = float(os.getenv('CORTANA_RETRY_BASE_DELAY', '0.5'))
+CORTANA_RETRY_MAX_DELAY = float(os.getenv('CORTANA_RETRY_MAX_DELAY', '8'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_PROBE_INTERVAL = float(os.getenv('CIRCUIT_PROBE_INTERVAL', '15'))
+CORTANA_HEALTH_PATH = os.getenv('CORTANA_HEALTH_PATH', '/health')  # must return 2xx when the backend is healthy
+# Probes answered with a non-2xx (e.g. no such route) before one real request is let through instead
+CIRCUIT_HALF_OPEN_AFTER = int(os.getenv('CIRCUIT_HALF_OPEN_AFTER', '3'))
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+
+# Default timeouts for every request on the shared session (CDN downloads included)
+HTTP_TIMEOUT = aiohttp.ClientTimeout(
+    total=CORTANA_TOTAL_TIMEOUT,
+    sock_connect=CORTANA_CONNECT_TIMEOUT,
+    sock_read=CORTANA_READ_TIMEOUT,
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised without contacting the backend while the circuit breaker is open"""
+
+
+class CortanaAPI:
+    """Cortana API client with retries for idempotent calls and a circuit breaker
+
+    After CIRCUIT_FAILURE_THRESHOLD consecutive failures (connection errors,
+    timeouts, 5xx responses or bodies that fail mid-read) the breaker opens: requests fail fast with
+    CircuitOpenError while a background task probes the backend, closing
+    the breaker again once its health route returns a 2xx. If the backend
+    answers CIRCUIT_HALF_OPEN_AFTER probes with anything else (it may have no
+    health route), the breaker goes half-open instead: one real request is let
+    through, and its outcome closes or reopens the breaker.
+    """
+
+    def __init__(self, session, base_url, max_retries=CORTANA_MAX_RETRIES,
+                 failure_threshold=CIRCUIT_FAILURE_THRESHOLD, probe_interval=CIRCUIT_PROBE_INTERVAL,
+                 half_open_after=CIRCUIT_HALF_OPEN_AFTER):
+        self.session = session
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.half_open_after = half_open_after
+        self.state = 'closed'  # closed, open or half_open
+        self.consecutive_failures = 0
+        self._probe_task = None
+        self._trial_in_flight = False  # a half-open trial request is running
+        self.stats = {
+            'requests': 0,
+            'retries': 0,
+            'failures': 0,
+            'short_circuited': 0,
+            'circuit_opened': 0,
+            'circuit_closed': 0,
+            'circuit_half_opened': 0,
+            'probes': 0,
+        }
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    def _record_success(self):
+        self.consecutive_failures = 0
+        if self.state != 'closed':
+            self._close_circuit()
+
+    def _record_failure(self):
+        self.stats['failures'] += 1
+        self.consecutive_failures += 1
+        if self.state == 'half_open':
+            print("⚠️ Cortana API trial request failed, circuit reopened")
+            self._open_circuit()
+        elif self.state == 'closed' and self.consecutive_failures >= self.failure_threshold:
+            print(f"⚠️ Cortana API circuit opened after {self.consecutive_failures} consecutive failures")
+            self._open_circuit()
+
+    def _open_circuit(self):
+        self.state = 'open'
+        self.stats['circuit_opened'] += 1
+        self._probe_task = asyncio.create_task(self._probe())
+
+    def _close_circuit(self):
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.stats['circuit_closed'] += 1
+        print("✅ Cortana API is responding again, circuit closed")
+
+    async def _probe(self):
+        """Poll the backend's health route until it returns a 2xx, then close the circuit"""
+        unhealthy_answers = 0
+        while self.state == 'open':
+            await asyncio.sleep(self.probe_interval)
+            self.stats['probes'] += 1
+            try:
+                async with self.session.get(self.url(CORTANA_HEALTH_PATH),
+                                            timeout=aiohttp.ClientTimeout(total=CORTANA_CONNECT_TIMEOUT)) as resp:
+                    # Anything but a 2xx (including a 404 for a missing route) is not proof of health
+                    if 200 <= resp.status < 300:
+                        self._close_circuit()
+                        return
+                    unhealthy_answers += 1
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                continue
+            if unhealthy_answers >= self.half_open_after:
+                # The backend is reachable but the probe can't tell if it works; let a real request decide
+                self.state = 'half_open'
+                self.stats['circuit_half_opened'] += 1
+                print("🔎 Cortana API circuit half-open, letting one request through")
+                return
+
+    def retry_delay(self, attempt):
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(CORTANA_RETRY_MAX_DELAY, CORTANA_RETRY_BASE_DELAY * 2 ** attempt))
+
+    @asynccontextmanager
+    async def request(self, method, path, idempotent=None, **kwargs):
+        """Send a request and yield the response; GET and reset-style calls can be retried"""
+        if idempotent is None:
+            idempotent = method.upper() in ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+        attempts = self.max_retries + 1 if idempotent else 1
+        trial = False  # this request is the one let through while half-open
+
+        try:
+            for attempt in range(attempts):
+                if self.state == 'open' or (self.state == 'half_open' and self._trial_in_flight and not trial):
+                    self.stats['short_circuited'] += 1
+                    raise CircuitOpenError('Cortana is temporarily unavailable')
+                if self.state == 'half_open':
+                    trial = self._trial_in_flight = True
+                if attempt:
+                    self.stats['retries'] += 1
+
+                self.stats['requests'] += 1
+                try:
+                    resp = await self.session.request(method, self.url(path), **kwargs)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    self._record_failure()
+                    if attempt + 1 >= attempts:
+                        raise
+                    print(f"⚠️ Cortana API {method} {path} failed ({e!r}), retrying")
+                    await asyncio.sleep(self.retry_delay(attempt))
+                    continue
+
+                if resp.status >= 500:
+                    self._record_failure()
+                if resp.status in RETRYABLE_STATUSES and attempt + 1 < attempts:
+                    resp.release()
+                    print(f"⚠️ Cortana API {method} {path} returned {resp.status}, retrying")
+                    await asyncio.sleep(self.retry_delay(attempt))
+                    continue
+
+                try:
+                    yield resp
+                except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    # The backend stalled or dropped the connection while sending the body
+                    if resp.status < 500:
+                        self._record_failure()
+                    raise
+                else:
+                    # Only a fully read response counts as success, so a backend that
+                    # stalls mid-body still trips the breaker
+                    if resp.status < 500:
+                        self._record_success()
+                finally:
+                    resp.release()
+                return
+        finally:
+            if trial:
+                # Whatever happened, the next request may be the trial if the breaker is still half-open
+                self._trial_in_flight = False
+
+    async def close(self):
+        if self._probe_task:
+            self._probe_task.cancel()
+            await asyncio.gather(self._probe_task, return_exceptions=True)
+
+
+class Client(commands.AutoShardedBot):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.recording = False
-        
-    async def on_ready(self):
-        print(f'We have logged in as {self.user}')
+        # All per-guild state lives in the process that owns the guild's shard
+        self.recording = {}  # guild id -> VoiceListener
+        # Set by run_shard_worker when running as one of several shard processes
+        self.worker_index = 0
+        self.report_queue = None
+        self.transcoder = FFmpegTranscoder()
+        self.audio_stats = {'clips': 0, 'failed': 0, 'bytes_in': 0, 'bytes_out': 0}
+        self.image_processor = ImageProcessor() if IMAGE_PREPROCESS_ENABLED and image_worker else None
+        if IMAGE_PREPROCESS_ENABLED and not image_worker:
+            print("⚠️ Pillow is not installed, images will be uploaded without preprocessing")
+        # Bounds concurrent CDN downloads across all messages
+        self.download_semaphore = asyncio.Semaphore(ATTACHMENT_DOWNLOAD_CONCURRENCY)
+        self.media_cache = MediaCache() if CACHE_ENABLED else None
+        self.background_tasks = set()
+        self.web_runner = None
+        self.cortana = None
+        # One scheduler lane per session, so independent conversations run concurrently
+        self.scheduler = RequestScheduler(self.handle_messages)
+        self.sessions = SessionRegistry()
+        # Per-guild voice playback queues, keyed by guild id
+        self.playback_queues = {}
+        # Long-lived HTTP session, created in setup_hook and closed in close()
+        self.http_session = None
+        self.http_stats = {
+            'requests': 0,
+            'connections_created': 0,
+            'connections_reused': 0,
+            'dns_cache_hits': 0,
+            'dns_cache_misses': 0,
+        }
+
+    def _build_trace_config(self):
+        """Count connection reuse vs new connections on the shared session"""
+        trace_config = aiohttp.TraceConfig()
+
+        def counter(key):
+            async def _increment(session, ctx, params):
+                self.http_stats[key] += 1
+            return _increment
+
+        trace_config.on_request_start.append(counter('requests'))
+        trace_config.on_connection_create_end.append(counter('connections_created'))
+        trace_config.on_connection_reuseconn.append(counter('connections_reused'))
+        trace_config.on_dns_cache_hit.append(counter('dns_cache_hits'))
+        trace_config.on_dns_cache_miss.append(counter('dns_cache_misses'))
+        return trace_config
+
+    async def setup_hook(self):
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            use_dns_cache=True,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        )
+        self.http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=HTTP_TIMEOUT,
+            trace_configs=[self._build_trace_config()],
+        )
+        self.cortana = CortanaAPI(self.http_session, CORTANA_API_URL)
+        print(f"✅ HTTP session ready (limit={HTTP_POOL_LIMIT}, per host={HTTP_POOL_LIMIT_PER_HOST})")
+        if self.media_cache:
+            await asyncio.to_thread(self.media_cache.load)
+        # Probe for FFmpeg in the background; transcodes reuse the cached result
+        self.create_background_task(probe_ffmpeg())
+        # Runs once per process rather than on every gateway reconnect (first worker only)
+        if self.application_id and self.worker_index == 0:
+            await self.sync_commands()
+        if HTTP_SERVER_ENABLED:
+            try:
+                # Shard workers each get their own port after the supervisor's
+                port = HTTP_SERVER_PORT + (self.worker_index + 1 if self.report_queue else 0)
+                self.web_runner = await start_http_server(port)
+            except OSError as e:
+                print(f"⚠️ Could not start HTTP server: {e}")
+        if self.report_queue:
+            self.create_background_task(self.report_shard_health())
+
+    def create_background_task(self, coro):
+        """Run a coroutine in the background, keeping a reference until it finishes"""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    def shard_health(self):
+        """Per-shard connection state, latency and guild count for this process"""
+        guild_counts = defaultdict(int)
+        for guild in self.guilds:
+            guild_counts[guild.shard_id] += 1
+        shards = []
+        for shard_id, shard in sorted(self.shards.items()):
+            latency = shard.latency
+            shards.append({
+                'id': shard_id,
+                'connected': not shard.is_closed(),
+                'latency': latency if latency == latency else None,  # NaN before the first heartbeat
+                'guilds': guild_counts[shard_id],
+            })
+        return {
+            'worker': self.worker_index,
+            'pid': os.getpid(),
+            'ready': self.is_ready(),
+            'shards': shards,
+            'in_flight': self.scheduler.in_flight,
+            'pending': self.scheduler.pending,
+            'reported_at': time.time(),
+        }
+
+    async def report_shard_health(self):
+        """Periodically send shard health to the supervisor process"""
+        while not self.is_closed():
+            try:
+                self.report_queue.put_nowait(self.shard_health())
+            except Exception as e:
+                print(f"⚠️ Could not report shard health: {e}")
+            await asyncio.sleep(SHARD_REPORT_INTERVAL)
+
+    async def close(self):
+        await self.scheduler.close()
+        tracer.close()
+        if self.image_processor:
+            self.image_processor.close()
+        if self.web_runner:
+            await self.web_runner.cleanup()
+        if self.cortana:
+            await self.cortana.close()
+        if self.http_session and not self.http_session.closed:
+            print(f"📊 HTTP stats: {self.http_stats}")
+            if self.media_cache:
+                print(f"📊 Media cache stats: {self.media_cache.stats}")
+            await self.http_session.close()
+        await super().close()
+
+    async def sync_commands(self):
+        """Sync the command tree only if the registered commands changed since the last sync"""
+        digest = command_tree_hash(self.tree, GUILD_ID, self.application_id)
+        try:
+            with open(COMMAND_SYNC_CACHE) as f:
+                synced_digest = f.read().strip()
+        except OSError:
+            synced_digest = None
+        if digest == synced_digest and not FORCE_COMMAND_SYNC:
+            print('✅ Commands unchanged since last sync, skipping')
+            return
+
         try:
             synced = await self.tree.sync(guild=GUILD_ID)
             print(f'Synced {len(synced)} commands')
         except Exception as e:
             print(f'Error syncing commands: {e}')
+            return
+        try:
+            os.makedirs(os.path.dirname(COMMAND_SYNC_CACHE) or '.', exist_ok=True)
+            with open(COMMAND_SYNC_CACHE, 'w') as f:
+                f.write(digest)
+        except OSError as e:
+            print(f"⚠️ Could not save command sync hash: {e}")
+
+    async def on_ready(self):
+        print(f'We have logged in as {self.user}')
 
+    async def on_voice_state_update(self, member, before, after):
+        # Stop listening if the bot was disconnected without /leave_voice
+        if member.id == self.user.id and after.channel is None:
+            self.stop_listening(member.guild)
 
 
-    async def play_audio_response(self, guild, audio_url):
-        """Play audio response in voice channel"""
+
+    async def create_audio_source(self, audio_url):
+        """Play a TTS clip from the cache, or stream its single download into FFmpeg and cache it when done"""
+        if self.media_cache:
+            key = cache_key('tts', audio_url)
+            audio_data = await self.media_cache.get(key)
+            if audio_data is not None:
+                return discord.FFmpegPCMAudio(io.BytesIO(audio_data), pipe=True)
+            try:
+                resp = await self.http_session.get(audio_url)
+            except Exception as e:
+                print(f"⚠️ Could not download audio response: {e}")
+            else:
+                if resp.status == 200:
+                    # Playback starts with the first chunk instead of waiting for the whole clip
+                    clip = StreamedClip()
+                    self.create_background_task(self.relay_remote_audio(resp, clip, key))
+                    return discord.FFmpegPCMAudio(clip, pipe=True)
+                resp.release()
+        # No cache, or the download failed: let FFmpeg fetch the URL itself
+        return discord.FFmpegPCMAudio(audio_url, before_options=FFMPEG_STREAM_BEFORE_OPTIONS)
+
+    async def relay_remote_audio(self, resp, clip, key):
+        """Feed a TTS download to FFmpeg as it arrives, then cache the clip if it completed and fits"""
+        data = bytearray()
         try:
-            voice_client = guild.voice_client
-            if voice_client and voice_client.is_connected():
-                # Download audio file
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(audio_url) as resp:
-                        if resp.status == 200:
-                            audio_data = await resp.read()
-                            
-                            # Create temporary file for audio
-                            with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
-                                temp_file.write(audio_data)
-                                temp_file_path = temp_file.name
-                            
-                            # Play the audio
-                            voice_client.play(discord.FFmpegPCMAudio(temp_file_path))
-                            
-                            # Wait for playback to finish
-                            while voice_client.is_playing():
-                                await asyncio.sleep(0.1)
-                            
-                            # Clean up
-                            os.unlink(temp_file_path)
+            async for chunk in resp.content.iter_chunked(ATTACHMENT_CHUNK_SIZE):
+                clip.feed(chunk)
+                if data is not None:
+                    data += chunk
+                    if len(data) > self.media_cache.max_item_bytes:
+                        data = None  # too large to cache; keep streaming it
         except Exception as e:
-            print(f"Error playing audio response: {e}")
+            print(f"⚠️ Audio response download failed: {e}")
+            data = None
+        finally:
+            clip.close()
+            resp.release()
+        if data is not None:
+            await self.media_cache.put(key, bytes(data))
+
+    async def preprocess_audio(self, file_data):
+        """Shrink a downloaded voice clip for upload, reusing earlier results for the same content
+
+        Returns the processed bytes, content type and file extension.
+        """
+        _, content_type, extension, _ = AUDIO_CODECS[AUDIO_OUTPUT_CODEC]
+        # Up to ATTACHMENT_MAX_BYTES of disk reads and hashing would otherwise stall the gateway
+        data, digest = await asyncio.to_thread(read_and_hash, file_data)
+        key = cache_key('speech', digest, sample_rate=AUDIO_SAMPLE_RATE, codec=AUDIO_OUTPUT_CODEC,
+                        filters=' '.join(speech_filter_args()))
+        with trace_span('audio_preprocess', bytes_in=len(data)) as span:
+            processed = await self.media_cache.get(key) if self.media_cache else None
+            span['cached'] = processed is not None
+            if processed is None:
+                processed, content_type, extension = await self.transcoder.preprocess_speech(data)
+                if self.media_cache:
+                    await self.media_cache.put(key, processed)
+            span['bytes_out'] = len(processed)
+        
+        self.audio_stats['clips'] += 1
+        self.audio_stats['bytes_in'] += len(data)
+        self.audio_stats['bytes_out'] += len(processed)
+        saved = len(data) - len(processed)
+        print(f"🎚️ Preprocessed audio: {format_size(len(data))} -> {format_size(len(processed))} "
+              f"({saved / len(data) * 100 if data else 0:.0f}% saved)")
+        return processed, content_type, extension
+
+    async def preprocess_images(self, images):
+        """Downscale a message's images in the process pool, keeping their total under MESSAGE_IMAGES_MAX_BYTES
+
+        Raises AttachmentTooLarge if images that cannot be shrunk push the total over the limit.
+        """
+        budget = MESSAGE_IMAGES_MAX_BYTES // len(images)
+        with trace_span('image_preprocess', images=len(images)) as span:
+            results = await asyncio.gather(*(self.preprocess_image(*image, budget) for image in images))
+            size_in = span['bytes_in'] = sum(size_in for _, size_in, _ in results)
+            size_out = span['bytes_out'] = sum(size_out for _, _, size_out in results)
+        if size_out > MESSAGE_IMAGES_MAX_BYTES:
+            # Only images sent unchanged (animated or undecodable) can go over their share
+            unchanged = [image[0] for image, _, image_size in results if image_size > budget]
+            raise AttachmentTooLarge(
+                f'{", ".join(unchanged)} could not be shrunk and the images are too large in total '
+                f'({format_size(size_out)}, limit {format_size(MESSAGE_IMAGES_MAX_BYTES)})'
+            )
+        print(f"🖼️ Preprocessed {len(images)} image(s): {format_size(size_in)} -> {format_size(size_out)}")
+        return [image for image, _, _ in results]
+
+    async def preprocess_image(self, filename, file_data, content_type, max_bytes):
+        """Return the (filename, data, content type) to upload for one image, with its size before and after"""
+        data, digest = await asyncio.to_thread(read_and_hash, file_data)
+        # Re-posted images are the same bytes under a new attachment ID, so key on the content
+        key = cache_key('image', digest, max_side=IMAGE_MAX_SIDE, max_pixels=IMAGE_MAX_PIXELS,
+                        format=IMAGE_FORMAT, quality=IMAGE_QUALITY, max_bytes=max_bytes)
+        output = await self.media_cache.get(key) if self.media_cache else None
+        if output is None:
+            try:
+                output = await self.image_processor.shrink(data, max_bytes)
+            except Exception as e:
+                # Pillow raises assorted errors for corrupt or unsupported files; upload those unchanged,
+                # preprocess_images still counts them against the message total
+                print(f"❌ Failed to preprocess {filename}: {e}")
+                output = None
+            if output is not None and self.media_cache:
+                await self.media_cache.put(key, output)
+        if output is None:
+            file_data.seek(0)
+            return (filename, file_data, content_type), len(data), len(data)
+        _, new_content_type, extension = IMAGE_FORMATS[IMAGE_FORMAT]
+        return (os.path.splitext(filename)[0] + extension, output, new_content_type), len(data), len(output)
+
+    def get_playback_queue(self, guild):
+        """Return the playback queue for a guild, creating it on first use"""
+        queue = self.playback_queues.get(guild.id)
+        if queue is None:
+            queue = VoicePlaybackQueue(guild, self.create_audio_source)
+            self.playback_queues[guild.id] = queue
+        return queue
+
+    async def play_audio_response(self, guild, audio_url):
+        """Queue an audio response for playback in the guild's voice channel
+
+        Returns the clip's position in the queue (0 means it plays next),
+        or None if it could not be queued.
+        """
+        voice_client = guild.voice_client
+        if not voice_client or not voice_client.is_connected():
+            return None
+        try:
+            return self.get_playback_queue(guild).enqueue(audio_url)
+        except asyncio.QueueFull:
+            print(f"⚠️ Playback queue full for guild {guild.id}")
+            return None
+
+    async def download_attachment(self, attachment):
+        """Stream an attachment from the Discord CDN into a spooled temp file
+
+        Returns None if the CDN does not return the file.
+        """
+        # Raw downloads are not cached: every upload gets a new ID, so they never repeat
+        # by ID, and the processed speech/image outputs are cached by content instead
+        with trace_span('download', filename=attachment.filename, bytes=attachment.size):
+            async with self.download_semaphore:
+                with metrics.timer('download'):
+                    return await self._download_to_spool(attachment)
+
+    async def _download_to_spool(self, attachment):
+        async with self.http_session.get(attachment.url) as resp:
+            if resp.status != 200:
+                print(f"❌ Failed to download {attachment.filename}: HTTP {resp.status}")
+                metrics.error('download')
+                return None
+            if resp.content_length and resp.content_length > ATTACHMENT_MAX_BYTES:
+                raise AttachmentTooLarge(
+                    f'{attachment.filename} is too large ({format_size(resp.content_length)}, '
+                    f'limit {format_size(ATTACHMENT_MAX_BYTES)})'
+                )
+            
+            spool = tempfile.SpooledTemporaryFile(max_size=ATTACHMENT_SPOOL_THRESHOLD)
+            try:
+                size = 0
+                async for chunk in resp.content.iter_chunked(ATTACHMENT_CHUNK_SIZE):
+                    size += len(chunk)
+                    # Guard against files larger than Discord reported
+                    if size > ATTACHMENT_MAX_BYTES:
+                        raise AttachmentTooLarge(
+                            f'{attachment.filename} is too large (limit {format_size(ATTACHMENT_MAX_BYTES)})'
+                        )
+                    spool.write(chunk)
+            except BaseException:
+                spool.close()
+                raise
+            spool.seek(0)
+            return spool
+
+    async def fetch_attachments(self, attachments):
+        """Download attachments concurrently, in the same order as given"""
+        results = await asyncio.gather(
+            *(self.download_attachment(attachment) for attachment in attachments),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            # Don't leak the files that did download
+            for result in results:
+                if result is not None and not isinstance(result, BaseException):
+                    result.close()
+            raise errors[0]
+        return results
+
+    async def stream_reply(self, channel, author, resp):
+        """Relay a streamed /chat response into Discord and return the final response data"""
+        reply = StreamingReply(channel, f'{author.mention}, ')
+        await reply.start()
+        response_data = {}
+        stream_started = time.monotonic()
+        completed = False
+        try:
+            async for event in iter_stream_events(resp):
+                if stream_started is not None:
+                    trace_mark('first_token', stream_started)
+                    stream_started = None
+                if isinstance(event, dict):
+                    # Keep metadata such as audio_url from any event
+                    for key, value in event.items():
+                        if key not in STREAM_DELTA_KEYS and key != 'response':
+                            response_data[key] = value
+                    delta = next((event[key] for key in STREAM_DELTA_KEYS if event.get(key)), None)
+                    if delta:
+                        await reply.append(str(delta))
+                    elif event.get('response') and not reply.text:
+                        # Some servers send the full reply in a single final event
+                        await reply.append(str(event['response']))
+                else:
+                    await reply.append(event)
+            completed = True
+        finally:
+            if not completed:
+                # Don't leave a half-written message with the cursor; the caller reports the error
+                reply.text += STREAM_INTERRUPTED
+                try:
+                    await reply.flush(final=True)
+                except Exception as e:
+                    print(f"Could not finalize interrupted reply: {e}")
+
+        if not reply.text:
+            reply.text = 'Sorry, I could not process your request.'
+        await reply.flush(final=True)
+        response_data['response'] = reply.text
+        return response_data
 
     async def on_message(self, message):
         if message.author == self.user:
@@ -127,94 +2069,134 @@ class Client(commands.Bot):
         # If no content and no attachments, ignore
         if not message.content and not message.attachments:
             return
-            
-        try:
-            # Prepare the data payload for bearer token API
+        
+        # Hand off to the scheduler; it orders, coalesces and rate limits /chat requests
+        if not self.scheduler.submit(message):
+            await message.channel.send(f'{message.author.mention}, ⏳ I\'m busy right now, please try again in a moment.')
+
+    async def handle_messages(self, messages):
+        """Send one or more coalesced messages from the same user to Cortana and reply"""
+        message = messages[-1]
+        query = '\n'.join(m.content for m in messages if m.content)
+        attachments = [attachment for m in messages for attachment in m.attachments]
+        
+        session = self.sessions.get(conversation_key(message))
+        trace_attrs(session=session.session_id)
+        
+        open_files = []
+        async with self.replying_on_error(message.channel, message.author):
+            try:
+                # Prepare headers with bearer token for Cortana API
+                headers = cortana_headers()
+                
+                # Prepare the data payload for bearer token API
+                data = {
+                    "query": query,
+                    "user": session.session_id,  # Cortana keeps one conversation per user id
+                    "user_name": message.author.display_name,
+                    "include_audio": False  # Boolean instead of string
+                }
+                
+                # Prepare files for upload (separate from data, like gradio)
+                # Files are spooled temp files (or bytes once transcoded), streamed into the upload
+                files_payload = {}
+                
+                # Handle attachments if present
+                is_voice_message = False
+                if attachments:
+                    # Reject oversized files before downloading anything
+                    check_attachment_sizes(attachments)
+                    
+                    # Download all attachments concurrently into spooled temp files
+                    downloads = await self.fetch_attachments(attachments)
+                    open_files.extend(f for f in downloads if f is not None)
+                    
+                    # Process all attachments
+                    for attachment, file_data in zip(attachments, downloads):
+                        if file_data is None:
+                            continue
+                        
+                        # Determine file type based on content type or filename
+                        content_type = attachment.content_type or 'application/octet-stream'
+                        filename = attachment.filename.lower()
+                        
+                        if content_type.startswith('image/') or filename.endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
+                            # For multiple images, use indexed keys or append to list
+                            if "images" not in files_payload:
+                                files_payload["images"] = []
+                            files_payload["images"].append((attachment.filename, file_data, content_type))
+                        elif (filename.endswith(('.ogg', '.mp3', '.wav', '.m4a', '.aac', '.flac')) or 
+                              content_type.startswith('audio/')):
+                            # Trim, downmix and resample every voice clip before upload
+                            if AUDIO_PREPROCESS_ENABLED:
+                                try:
+                                    file_data, content_type, extension = await self.preprocess_audio(file_data)
+                                    
+                                    # Update filename to match the new encoding
+                                    attachment.filename = os.path.splitext(attachment.filename)[0] + extension
+                                    
+                                except TranscodeError as e:
+                                    self.audio_stats['failed'] += 1
+                                    print(f"❌ Failed to preprocess {attachment.filename}: {e}")
+                                    # Use original file if preprocessing fails
+                                    file_data.seek(0)
+                            
+                            files_payload["voice"] = (attachment.filename, file_data, content_type)
+                            is_voice_message = True
+                            # For voice messages, request audio response
+                            data["include_audio"] = True
+                        else:
+                            files_payload["document"] = (attachment.filename, file_data, content_type)
+
+                # Downscale photos off the event loop before they are uploaded
+                if files_payload.get("images") and self.image_processor:
+                    files_payload["images"] = await self.preprocess_images(files_payload["images"])
+
+                await self.chat(message.channel, message.author, message.guild, headers, data, files_payload, is_voice_message)
+            finally:
+                for file_obj in open_files:
+                    file_obj.close()
+
+    async def handle_utterances(self, utterances):
+        """Scheduler handler for utterances captured in a voice channel"""
+        trace = current_trace.get()
+        if trace is not None:
+            trace.name = 'utterance'
+        for utterance in utterances:
+            await self.handle_utterance(utterance.guild, utterance.channel, utterance.author, utterance.wav_data)
+
+    async def handle_utterance(self, guild, channel, member, wav_data):
+        """Send a spoken utterance captured in a voice channel to Cortana, like a voice message"""
+        print(f"🎤 Utterance from {member} ({format_size(len(wav_data))})")
+        session = self.sessions.get(session_key(guild.id, channel.id, member.id))
+        trace_attrs(session=session.session_id, utterance_bytes=len(wav_data))
+        async with self.replying_on_error(channel, member):
             data = {
-                "query": message.content,
-                "user": "Tristan Padiou",  # Use Discord username
-                "include_audio": False  # Boolean instead of string
+                "query": "",
+                "user": session.session_id,
+                "user_name": member.display_name,
+                "include_audio": True
             }
-            
-            # Prepare files for upload (separate from data, like gradio)
-            files_payload = {}
-            
-            # Handle attachments if present
-            is_voice_message = False
-            if message.attachments:
-                # Process all attachments
-                async with aiohttp.ClientSession() as session:
-                    for i, attachment in enumerate(message.attachments):
-                        # Download the attachment
-                        async with session.get(attachment.url) as resp:
-                            if resp.status == 200:
-                                file_data = await resp.read()
-                                
-                                # Determine file type based on content type or filename
-                                content_type = attachment.content_type or 'application/octet-stream'
-                                filename = attachment.filename.lower()
-                                
-                                if content_type.startswith('image/') or filename.endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
-                                    # For multiple images, use indexed keys or append to list
-                                    if "images" not in files_payload:
-                                        files_payload["images"] = []
-                                    files_payload["images"].append((attachment.filename, file_data, content_type))
-                                elif (filename.endswith(('.ogg', '.mp3', '.wav', '.m4a', '.aac', '.flac')) or 
-                                      content_type.startswith('audio/')):
-                                    # Convert .ogg files to .wav
-                                    if filename.endswith('.ogg'):
-                                        try:
-                                            # Create temporary files for conversion
-                                            with tempfile.NamedTemporaryFile(suffix='.ogg', delete=False) as temp_ogg:
-                                                temp_ogg.write(file_data)
-                                                temp_ogg_path = temp_ogg.name
-                                            
-                                            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_wav:
-                                                temp_wav_path = temp_wav.name
-                                            
-                                            # Convert using FFmpeg
-                                            result = subprocess.run([
-                                                'ffmpeg', '-i', temp_ogg_path, 
-                                                '-ar', '16000',  # 16kHz sample rate
-                                                '-ac', '1',      # mono channel
-                                                '-y',            # overwrite output file
-                                                temp_wav_path
-                                            ], capture_output=True, check=True)
-                                            
-                                            # Read the converted file
-                                            with open(temp_wav_path, 'rb') as f:
-                                                file_data = f.read()
-                                            
-                                            # Update filename and content type
-                                            attachment.filename = attachment.filename.replace('.ogg', '.wav')
-                                            content_type = 'audio/wav'
-                                            
-                                            # Clean up temporary files
-                                            os.unlink(temp_ogg_path)
-                                            os.unlink(temp_wav_path)
-                                            
-                                            print(f"✅ Converted {attachment.filename} from .ogg to .wav")
-                                            
-                                        except subprocess.CalledProcessError as e:
-                                            print(f"❌ Failed to convert .ogg to .wav: {e}")
-                                            print(f"FFmpeg stderr: {e.stderr.decode() if e.stderr else 'No stderr'}")
-                                            # Use original file if conversion fails
-                                        except Exception as e:
-                                            print(f"❌ Error during .ogg conversion: {e}")
-                                            # Use original file if conversion fails
-                                    
-                                    files_payload["voice"] = (attachment.filename, file_data, content_type)
-                                    is_voice_message = True
-                                    # For voice messages, request audio response
-                                    data["include_audio"] = True
-                                else:
-                                    files_payload["document"] = (attachment.filename, file_data, content_type)
-            
-            # Make request to Cortana API
-            chat_url = f"{CORTANA_API_URL}/chat"
-            
-            # Create FormData for aiohttp (equivalent to requests.post with data and files)
+            files_payload = {"voice": ('utterance.wav', wav_data, 'audio/wav')}
+            await self.chat(channel, member, guild, cortana_headers(), data, files_payload, is_voice_message=True)
+
+    def stop_listening(self, guild):
+        listener = self.recording.pop(guild.id, None)
+        if listener:
+            listener.stop()
+        return listener is not None
+
+    async def chat(self, channel, author, guild, headers, data, files_payload, is_voice_message=False):
+        """Send a prepared request to Cortana's /chat endpoint and relay the reply to the channel"""
+        # Ask the API to stream tokens back if enabled (falls back to JSON if unsupported)
+        if STREAM_REPLIES:
+            data["stream"] = True
+        
+        # Make request to Cortana API
+        # Create FormData for aiohttp (equivalent to requests.post with data and files)
+        with trace_span('form_build') as span:
             form_data = aiohttp.FormData()
+            upload_bytes = 0
             
             # Add regular data fields
             for key, value in data.items():
@@ -230,54 +2212,98 @@ class Client(commands.Bot):
                     # Handle multiple images
                     for filename, file_data, content_type in value:
                         form_data.add_field("images", file_data, filename=filename, content_type=content_type)
+                        upload_bytes += payload_size(file_data)
                 else:
                     # Handle single files (voice, document, etc.)
                     filename, file_data, content_type = value
                     form_data.add_field(key, file_data, filename=filename, content_type=content_type)
-            
-            # Prepare headers with bearer token for Cortana API
-            headers = {
-                'Authorization': f'Bearer {BEARER_TOKEN}'
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(chat_url, data=form_data, headers=headers) as resp:
-                    if resp.status == 200:
+                    upload_bytes += payload_size(file_data)
+            span['upload_bytes'] = upload_bytes
+        trace_attrs(upload_bytes=upload_bytes, query_chars=len(data.get('query', '')),
+                    files=sorted(files_payload), voice=is_voice_message)
+        
+        if STREAM_REPLIES:
+            headers['Accept'] = 'text/event-stream, application/x-ndjson, application/json'
+        
+        chat_started = time.perf_counter()
+        request_started = time.monotonic()
+        # /chat is not idempotent, so it is never retried
+        async with self.cortana.request('POST', '/chat', data=form_data, headers=headers) as resp:
+            # Time until the response headers arrived
+            trace_mark('chat', request_started, status=resp.status)
+            if resp.status == 200:
+                if resp.content_type in STREAM_CONTENT_TYPES:
+                    # Edit a placeholder message as the reply streams in
+                    with trace_span('stream_reply'):
+                        response_data = await self.stream_reply(channel, author, resp)
+                    metrics.observe('chat', time.perf_counter() - chat_started)
+                else:
+                    with trace_span('read_response'):
                         response_data = await resp.json()
-                        cortana_response = response_data.get('response', 'Sorry, I could not process your request.')
-                        
-                        # Send response back to Discord
-                        await message.channel.send(f'{message.author.mention}, {cortana_response}')
-                        
-                        # If audio URL is provided and this was a voice message, play it in voice channel
-                        if response_data.get('audio_url'):
-                            if is_voice_message and message.guild.voice_client:
-                                await client.play_audio_response(message.guild, response_data['audio_url'])
-                                await message.channel.send("🔊 Playing audio response in voice channel!")
-                            else:
-                                await message.channel.send(f"Audio response: {response_data['audio_url']}")
+                    metrics.observe('chat', time.perf_counter() - chat_started)
+                    cortana_response = response_data.get('response', 'Sorry, I could not process your request.')
+                    
+                    # Send response back to Discord
+                    with trace_span('send') as span:
+                        chunks = split_message(f'{author.mention}, {cortana_response}')
+                        span['messages'] = len(chunks)
+                        for chunk in chunks:
+                            await channel.send(chunk)
+                trace_attrs(response_chars=len(response_data.get('response') or ''))
+                
+                # If audio URL is provided and this was a voice message, play it in voice channel
+                if response_data.get('audio_url'):
+                    if is_voice_message and guild.voice_client:
+                        # Playback itself happens later in the guild's playback queue
+                        with trace_span('voice_enqueue') as span:
+                            position = span['position'] = await self.play_audio_response(guild, response_data['audio_url'])
+                        if position is None:
+                            await channel.send(f"Audio response: {response_data['audio_url']}")
+                        elif position:
+                            await channel.send(f"🔊 Audio response queued in voice channel (position {position + 1})")
+                        else:
+                            await channel.send("🔊 Playing audio response in voice channel!")
                     else:
-                        error_text = await resp.text()
-                        print(f"API Error: {resp.status} - {error_text}")
-                        await message.channel.send(f'{message.author.mention}, Sorry, I encountered an error processing your request.')
-                        
+                        await channel.send(f"Audio response: {response_data['audio_url']}")
+            else:
+                error_text = await resp.text()
+                metrics.observe('chat', time.perf_counter() - chat_started)
+                metrics.error('chat_api')
+                trace_attrs(error=f'HTTP {resp.status}')
+                print(f"API Error: {resp.status} - {error_text}")
+                await channel.send(f'{author.mention}, Sorry, I encountered an error processing your request.')
+
+    @asynccontextmanager
+    async def replying_on_error(self, channel, author):
+        """Turn failures anywhere in the request pipeline into a reply in the channel"""
+        try:
+            yield
+        except AttachmentTooLarge as e:
+            trace_attrs(error=type(e).__name__)
+            print(f"Rejected attachment: {e}")
+            await channel.send(f'{author.mention}, ❌ {e}')
+        except CircuitOpenError:
+            trace_attrs(error='CircuitOpenError')
+            await channel.send(f'{author.mention}, 😴 Cortana is temporarily unavailable. Please try again in a minute.')
+        except asyncio.TimeoutError:
+            metrics.error('chat_timeout')
+            trace_attrs(error='TimeoutError')
+            print("Cortana API request timed out")
+            await channel.send(f'{author.mention}, ⌛ Cortana took too long to respond. Please try again.')
         except Exception as e:
+            metrics.error('handler')
+            trace_attrs(error=type(e).__name__)
             print(f"Error in on_message: {e}")
-            await message.channel.send(f'{message.author.mention}, Sorry, I encountered an error: {str(e)}')
+            await channel.send(f'{author.mention}, Sorry, I encountered an error: {str(e)}')
 
 intents = discord.Intents.default()
 intents.message_content = True
 client = Client(command_prefix='!', intents=intents)
 
-# Simple HTTP handler for Hugging Face spaces
-class HealthHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == '/health' or self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            status = "✅ Connected" if client.is_ready() else "⚠️ Connecting..."
-            self.wfile.write(f"""
+# Status page and Prometheus metrics, served on the bot's own event loop
+async def status_page(request):
+    status = "✅ Connected" if client.is_ready() else "⚠️ Connecting..."
+    return web.Response(content_type='text/html', text=f"""
             <html>
                 <head><title>Cortana Discord Bot</title></head>
                 <body>
@@ -287,21 +2313,78 @@ class HealthHandler(BaseHTTPRequestHandler):
                     <p>Guilds: {len(client.guilds) if client.is_ready() else 'N/A'}</p>
                 </body>
             </html>
-            """.encode())
-        else:
-            self.send_response(404)
-            self.end_headers()
-    
-    def log_message(self, format, *args):
-        # Suppress HTTP server logs
-        pass
-
-def start_http_server():
-    """Start a simple HTTP server for Hugging Face spaces"""
-    port = int(os.environ.get('PORT', 7860))  # HF spaces typically use port 7860
-    server = HTTPServer(('0.0.0.0', port), HealthHandler)
-    print(f"🌐 HTTP server starting on port {port}")
-    server.serve_forever()
+            """)
+
+def render_metrics():
+    """Collect all metrics in the Prometheus text exposition format"""
+    lines = []
+    for histogram in metrics.histograms.values():
+        lines += histogram.render()
+    lines += render_metric('cortana_gateway_latency_seconds', 'gauge', 'Discord gateway heartbeat latency per shard',
+                           [({'shard': shard_id}, latency if latency == latency else 0)  # NaN before the first heartbeat
+                            for shard_id, latency in client.latencies])
+    lines += render_metric('cortana_ready', 'gauge', 'Whether the bot is connected to Discord',
+                           [({}, int(client.is_ready()))])
+    lines += render_metric('cortana_guilds', 'gauge', 'Guilds the bot is in', [({}, len(client.guilds))])
+    lines += render_metric('cortana_requests_in_flight', 'gauge', 'Requests currently being handled',
+                           [({}, client.scheduler.in_flight)])
+    lines += render_metric('cortana_requests_pending', 'gauge', 'Messages waiting in the scheduler',
+                           [({}, client.scheduler.pending)])
+    lines += render_metric('cortana_scheduler_total', 'counter', 'Scheduler events',
+                           [({'event': event}, count) for event, count in client.scheduler.stats.items()])
+    lines += render_metric('cortana_errors_total', 'counter', 'Errors by pipeline stage',
+                           [({'stage': stage}, count) for stage, count in metrics.errors.items()])
+    lines += render_metric('cortana_traces_total', 'counter', 'Request traces',
+                           [({'event': event}, count) for event, count in tracer.stats.items()])
+    lines += render_metric('cortana_sessions', 'gauge', 'Conversation sessions tracked', [({}, len(client.sessions))])
+    lines += render_metric('cortana_sessions_total', 'counter', 'Conversation session events',
+                           [({'event': event}, count) for event, count in client.sessions.stats.items()])
+    lines += render_metric('cortana_ffmpeg_jobs_running', 'gauge', 'FFmpeg jobs running',
+                           [({}, client.transcoder.running)])
+    lines += render_metric('cortana_ffmpeg_queue_depth', 'gauge', 'FFmpeg jobs waiting for a worker',
+                           [({}, client.transcoder.queue_depth)])
+    lines += render_metric('cortana_audio_preprocess_total', 'counter', 'Audio attachments preprocessed before upload',
+                           [({'result': 'ok'}, client.audio_stats['clips']), ({'result': 'failed'}, client.audio_stats['failed'])])
+    lines += render_metric('cortana_audio_bytes_total', 'counter', 'Audio bytes before and after preprocessing',
+                           [({'stage': 'in'}, client.audio_stats['bytes_in']), ({'stage': 'out'}, client.audio_stats['bytes_out'])])
+    lines += render_metric('cortana_audio_bytes_saved_total', 'counter', 'Upload bytes saved by audio preprocessing',
+                           [({}, client.audio_stats['bytes_in'] - client.audio_stats['bytes_out'])])
+    if client.image_processor:
+        lines += render_metric('cortana_image_preprocess_total', 'counter', 'Images preprocessed before upload',
+                               [({'result': key}, client.image_processor.stats[key])
+                                for key in ('processed', 'passthrough', 'failed')])
+        lines += render_metric('cortana_image_bytes_total', 'counter', 'Image bytes before and after preprocessing',
+                               [({'stage': 'in'}, client.image_processor.stats['bytes_in']),
+                                ({'stage': 'out'}, client.image_processor.stats['bytes_out'])])
+    lines += render_metric('cortana_voice_playback_queue_depth', 'gauge', 'Voice clips queued or playing per guild',
+                           [({'guild': guild_id}, queue.depth) for guild_id, queue in client.playback_queues.items()])
+    if client.cortana:
+        lines += render_metric('cortana_api_circuit_open', 'gauge',
+                               'Whether the Cortana API circuit breaker is open or half-open',
+                               [({}, int(client.cortana.state != 'closed'))])
+        lines += render_metric('cortana_api_total', 'counter', 'Cortana API client events',
+                               [({'event': event}, count) for event, count in client.cortana.stats.items()])
+    lines += render_metric('cortana_http_client_total', 'counter', 'Shared HTTP session events',
+                           [({'event': event}, count) for event, count in client.http_stats.items()])
+    if client.media_cache:
+        lines += render_metric('cortana_media_cache_total', 'counter', 'Media cache events',
+                               [({'event': event}, count) for event, count in client.media_cache.stats.items()])
+    return '\n'.join(lines) + '\n'
+
+async def metrics_page(request):
+    return web.Response(body=render_metrics().encode(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+async def start_http_server(port=HTTP_SERVER_PORT):
+    """Start the status/metrics server on the running event loop"""
+    app = web.Application()
+    app.router.add_get('/', status_page)
+    app.router.add_get('/health', status_page)
+    app.router.add_get('/metrics', metrics_page)
+    runner = web.AppRunner(app, access_log=None)  # Suppress HTTP server logs
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+    print(f"🌐 HTTP server started on port {port}")
+    return runner
 
 # Voice Commands
 @client.tree.command(name='join_voice', description='Join your voice channel', guild=GUILD_ID)
@@ -314,6 +2397,9 @@ async def join_voice(interaction: discord.Interaction):
             channel = interaction.user.voice.channel
             if interaction.guild.voice_client:
                 await interaction.guild.voice_client.move_to(channel)
+            elif voice_recv:
+                # Receive-capable voice client, needed for /start_listening
+                await channel.connect(cls=voice_recv.VoiceRecvClient)
             else:
                 await channel.connect()
             await interaction.followup.send(f'✅ Joined {channel.name}!')
@@ -337,6 +2423,10 @@ async def leave_voice(interaction: discord.Interaction):
         await interaction.response.defer()
         
         if interaction.guild.voice_client:
+            client.stop_listening(interaction.guild)
+            queue = client.playback_queues.pop(interaction.guild.id, None)
+            if queue:
+                queue.clear()
             await interaction.guild.voice_client.disconnect()
             await interaction.followup.send('✅ Left the voice channel!')
         else:
@@ -363,16 +2453,29 @@ async def start_listening(interaction: discord.Interaction):
             await interaction.followup.send('❌ Bot is not connected to a voice channel! Use /join_voice first.')
             return
         
-        if client.recording:
+        listener = client.recording.get(interaction.guild.id)
+        if listener and not listener.is_active():
+            # Left over from a voice connection that has since dropped
+            client.stop_listening(interaction.guild)
+        elif listener:
             await interaction.followup.send('⚠️ Already listening for voice commands!')
             return
         
-        await interaction.followup.send('🎤 **Voice Command Mode Active!**\n\n'
-                                       '**Instructions:**\n'
-                                       '1. Record your voice message using Discord\'s voice recording feature\n'
-                                       '2. Send the audio file as an attachment in this chat\n'
-                                       '3. I\'ll process it and respond with both text and audio!\n\n'
-                                       '**Alternative:** Upload any audio file (.mp3, .wav, .ogg) and I\'ll process it.')
+        if voice_recv is None or not isinstance(voice_client, voice_recv.VoiceRecvClient):
+            # Voice receive unavailable: fall back to the record-and-upload workflow
+            await interaction.followup.send('🎤 **Voice Command Mode Active!**\n\n'
+                                           '**Instructions:**\n'
+                                           '1. Record your voice message using Discord\'s voice recording feature\n'
+                                           '2. Send the audio file as an attachment in this chat\n'
+                                           '3. I\'ll process it and respond with both text and audio!\n\n'
+                                           '**Alternative:** Upload any audio file (.mp3, .wav, .ogg) and I\'ll process it.')
+            return
+        
+        listener = VoiceListener(client, interaction.guild, interaction.channel)
+        listener.start(voice_client)
+        client.recording[interaction.guild.id] = listener
+        await interaction.followup.send('🎤 **Listening!** Just talk in the voice channel; I\'ll answer here and out loud. '
+                                       'Use /stop_listening to stop.')
         
     except Exception as e:
         print(f"Error in start_listening: {e}")
@@ -385,26 +2488,46 @@ async def start_listening(interaction: discord.Interaction):
             except:
                 print(f"Could not send error message: {e}")
 
-@client.tree.command(name='reset_cortana', description='Reset the conversation', guild=GUILD_ID)
-async def reset_cortana(interaction: discord.Interaction):
+@client.tree.command(name='stop_listening', description='Stop listening for voice commands', guild=GUILD_ID)
+async def stop_listening(interaction: discord.Interaction):
     try:
         # Defer the response immediately to prevent interaction timeout
         await interaction.response.defer()
         
-        # Make request to reset endpoint
-        reset_url = f"{CORTANA_API_URL}/reset"
+        if client.stop_listening(interaction.guild):
+            await interaction.followup.send('🔇 Stopped listening.')
+        else:
+            await interaction.followup.send('❌ Not listening right now!')
+    except Exception as e:
+        print(f"Error in stop_listening: {e}")
+        try:
+            await interaction.followup.send(f'❌ Error stopping voice listening: {str(e)}')
+        except:
+            print(f"Could not send error message: {e}")
+
+@client.tree.command(name='reset_cortana', description='Reset your conversation with Cortana', guild=GUILD_ID)
+async def reset_cortana(interaction: discord.Interaction):
+    try:
+        # Defer the response immediately to prevent interaction timeout
+        await interaction.response.defer()
         
         # Prepare headers with bearer token for Cortana API
-        headers = {
-            'Authorization': f'Bearer {BEARER_TOKEN}'
-        }
+        headers = cortana_headers()
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(reset_url, headers=headers) as resp:
-                if resp.status == 200:
-                    await interaction.followup.send(f'{interaction.user.mention}, ✅ Cortana\'s memory has been reset successfully.')
-                else:
-                    await interaction.followup.send(f'{interaction.user.mention}, ❌ Failed to reset Cortana\'s memory.')
+        # Only the caller's own conversation is reset
+        guild_id = interaction.guild.id if interaction.guild else None
+        key = session_key(guild_id, interaction.channel_id, interaction.user.id)
+        session = client.sessions.reset(key) or Session(key)
+        
+        # Make request to reset endpoint (safe to retry: resetting twice is the same as once)
+        async with client.cortana.request('POST', '/reset', idempotent=True, headers=headers,
+                                          data={'user': session.session_id}) as resp:
+            if resp.status == 200:
+                await interaction.followup.send(f'{interaction.user.mention}, ✅ Your conversation with Cortana has been reset.')
+            else:
+                await interaction.followup.send(f'{interaction.user.mention}, ❌ Failed to reset Cortana\'s memory.')
+    except CircuitOpenError:
+        await interaction.followup.send(f'{interaction.user.mention}, 😴 Cortana is temporarily unavailable. Please try again in a minute.')
     except Exception as e:
         print(f"Error in reset_cortana: {e}")
         try:
@@ -416,14 +2539,155 @@ async def reset_cortana(interaction: discord.Interaction):
             except:
                 print(f"Could not send error message: {e}")
 
-# Start HTTP server in a separate thread for Hugging Face spaces
-# http_thread = threading.Thread(target=start_http_server, daemon=True)
-# http_thread.start()
-
-# Start the Discord bot
-print("🤖 Starting Cortana Discord Bot...")
-# Support both DISCORD_TOKEN and bot_token for backwards compatibility
-if not BOT_TOKEN:
-    print("❌ Error: BOT_TOKEN environment variable not set!")
-    exit(1)
-client.run(BOT_TOKEN)
\ No newline at end of file
+# Multi-process sharding
+# Each worker process runs a contiguous range of shards; guilds (and their voice
+# clients, listening state and playback queues) only ever live in one worker.
+def run_shard_worker(worker_index, shard_ids, shard_count, report_queue):
+    """Entry point of a shard worker process"""
+    client.shard_ids = list(shard_ids)
+    client.shard_count = shard_count
+    client.worker_index = worker_index
+    client.report_queue = report_queue
+    # Rotating files can't be shared between processes
+    root, ext = os.path.splitext(TRACE_FILE)
+    tracer.path = f'{root}.worker{worker_index}{ext}'
+    # Each worker indexes and evicts its own cache directory, with its share of the disk budget
+    if client.media_cache:
+        workers = math.ceil(shard_count / SHARDS_PER_PROCESS)
+        client.media_cache.directory = os.path.join(CACHE_DIR, f'worker{worker_index}')
+        client.media_cache.disk_bytes = CACHE_DISK_BYTES // workers
+    print(f"🤖 Worker {worker_index} running shards {shard_ids[0]}-{shard_ids[-1]} of {shard_count}")
+    client.run(BOT_TOKEN)
+
+
+async def fetch_recommended_shard_count():
+    """Ask Discord how many shards the bot should use"""
+    headers = {'Authorization': f'Bot {BOT_TOKEN}'}
+    async with aiohttp.ClientSession(timeout=HTTP_TIMEOUT) as session:
+        async with session.get('https://discord.com/api/v10/gateway/bot', headers=headers) as resp:
+            resp.raise_for_status()
+            return (await resp.json())['shards']
+
+
+class ShardSupervisor:
+    """Starts shard worker processes, restarts them if they die and collects their health reports"""
+
+    def __init__(self, shard_count, shards_per_process):
+        self.shard_count = shard_count
+        self.groups = [list(range(start, min(start + shards_per_process, shard_count)))
+                       for start in range(0, shard_count, shards_per_process)]
+        self.context = multiprocessing.get_context('spawn')
+        self.report_queue = self.context.Queue()
+        self.processes = {}  # worker index -> Process
+        self.reports = {}  # worker index -> latest health report
+        self.restarts = defaultdict(int)
+
+    def start_worker(self, index):
+        process = self.context.Process(
+            target=run_shard_worker,
+            args=(index, self.groups[index], self.shard_count, self.report_queue),
+            name=f'cortana-shard-worker-{index}',
+            # Not daemonic: workers start their own image process pools, and run() stops them on exit
+            daemon=False,
+        )
+        process.start()
+        self.processes[index] = process
+
+    def health(self):
+        """Aggregate the latest reports of all workers"""
+        now = time.time()
+        workers = []
+        for index, group in enumerate(self.groups):
+            process = self.processes.get(index)
+            report = self.reports.get(index, {})
+            workers.append({
+                'worker': index,
+                'shard_ids': group,
+                'alive': bool(process and process.is_alive()),
+                'restarts': self.restarts[index],
+                'stale': now - report.get('reported_at', 0) > SHARD_REPORT_INTERVAL * 3,
+                **{key: value for key, value in report.items() if key != 'worker'},
+            })
+        return {'shard_count': self.shard_count, 'workers': workers}
+
+    async def status_page(self, request):
+        health = self.health()
+        healthy = all(worker['alive'] and not worker['stale'] for worker in health['workers'])
+        return web.json_response(health, status=200 if healthy else 503)
+
+    async def collect_reports(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                report = await loop.run_in_executor(None, self.report_queue.get, True, 1.0)
+            except queue.Empty:
+                continue
+            self.reports[report['worker']] = report
+
+    async def watch_workers(self):
+        while True:
+            await asyncio.sleep(SHARD_REPORT_INTERVAL)
+            for index, process in list(self.processes.items()):
+                if not process.is_alive():
+                    self.restarts[index] += 1
+                    print(f"⚠️ Shard worker {index} exited with code {process.exitcode}, restarting")
+                    self.start_worker(index)
+            summary = ', '.join(
+                f"w{worker['worker']}: {'up' if worker['alive'] else 'down'}"
+                f" ({sum(shard['guilds'] for shard in worker.get('shards', []))} guilds)"
+                for worker in self.health()['workers']
+            )
+            print(f"📊 Shards: {summary}")
+
+    async def run(self):
+        print(f"🤖 Supervising {self.shard_count} shards across {len(self.groups)} worker processes")
+        runner = None
+        if HTTP_SERVER_ENABLED:
+            app = web.Application()
+            app.router.add_get('/', self.status_page)
+            app.router.add_get('/health', self.status_page)
+            app.router.add_get('/shards', self.status_page)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, '0.0.0.0', HTTP_SERVER_PORT).start()
+            print(f"🌐 Supervisor status server started on port {HTTP_SERVER_PORT}")
+
+        collector = asyncio.create_task(self.collect_reports())
+        try:
+            for index, group in enumerate(self.groups):
+                self.start_worker(index)
+                # Discord only allows one IDENTIFY every 5 seconds per bot
+                if index + 1 < len(self.groups):
+                    await asyncio.sleep(SHARD_STARTUP_DELAY * len(group))
+            await self.watch_workers()
+        finally:
+            collector.cancel()
+            for process in self.processes.values():
+                process.terminate()
+            for process in self.processes.values():
+                process.join(timeout=10)
+            if runner:
+                await runner.cleanup()
+
+
+async def run_supervisor():
+    shard_count = SHARD_COUNT or await fetch_recommended_shard_count()
+    await ShardSupervisor(shard_count, SHARDS_PER_PROCESS).run()
+
+
+# Start the Discord bot (skipped when imported, e.g. by the benchmarks or shard workers)
+if __name__ == '__main__':
+    print("🤖 Starting Cortana Discord Bot...")
+    # Support both DISCORD_TOKEN and bot_token for backwards compatibility
+    if not BOT_TOKEN:
+        print("❌ Error: BOT_TOKEN environment variable not set!")
+        exit(1)
+    if SHARDS_PER_PROCESS > 0:
+        try:
+            asyncio.run(run_supervisor())
+        except KeyboardInterrupt:
+            pass
+    else:
+        if SHARD_COUNT:
+            client.shard_count = SHARD_COUNT
+        client.run(BOT_TOKEN)
@@ -0,0 +1,69 @@
+"""Image downscaling for the bot's image worker processes
+
+Kept apart from discord_bot.py so that spawned workers import only Pillow, not the
+whole bot; every setting is passed in by the caller.
+"""
+import io
+import math
+
+from PIL import Image, ImageOps
+
+MIN_QUALITY = 40  # below this, shrink the image instead of lowering quality further
+
+
+def image_scale(size, max_side, max_pixels):
+    """Scale factor (at most 1) that fits an image within the side and pixel caps"""
+    width, height = size
+    return min(1.0, max_side / max(width, height), math.sqrt(max_pixels / (width * height)))
+
+
+def shrink_image(data, max_bytes, pil_format, quality, max_side, max_pixels, passthrough_bytes):
+    """Downscale and re-encode one image without its metadata
+
+    Returns the encoded bytes, or None if the original should be sent unchanged.
+    """
+    with Image.open(io.BytesIO(data)) as original:
+        scale = image_scale(original.size, max_side, max_pixels)
+        if scale == 1.0 and len(data) <= min(passthrough_bytes, max_bytes):
+            return None
+        if getattr(original, 'is_animated', False):
+            # Re-encoding would keep only the first frame
+            return None
+        if scale < 1.0:
+            # Let the JPEG decoder downscale while decoding, which is much faster than a full decode
+            original.draft('RGB', (round(original.width * scale), round(original.height * scale)))
+        # Apply the EXIF orientation before the EXIF data is dropped
+        image = ImageOps.exif_transpose(original)
+
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    if has_alpha and pil_format == 'WEBP':
+        image = image.convert('RGBA')
+    elif has_alpha:
+        # JPEG has no alpha channel; flatten onto white
+        rgba = image.convert('RGBA')
+        image = Image.new('RGB', rgba.size, (255, 255, 255))
+        image.paste(rgba, mask=rgba.getchannel('A'))
+    else:
+        image = image.convert('RGB')
+
+    extra_scale = 1.0
+    while True:
+        scale = image_scale(image.size, max_side, max_pixels) * extra_scale
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        resized = image.resize(size, Image.Resampling.LANCZOS) if size != image.size else image
+        buffer = io.BytesIO()
+        # Nothing from the original's info (EXIF, ICC profile, comments) is passed on
+        resized.save(buffer, pil_format, quality=quality, optimize=True)
+        output = buffer.getvalue()
+        if len(output) <= max_bytes or max(size) <= 256:
+            break
+        # Over the byte budget: lower quality first, then resolution
+        if quality > MIN_QUALITY:
+            quality = max(MIN_QUALITY, quality - 15)
+        else:
+            extra_scale *= 0.75
+
+    if image_scale(image.size, max_side, max_pixels) == 1.0 and len(output) >= len(data) <= max_bytes:
+        # Re-encoding a small image did not help
+        return None
+    return output
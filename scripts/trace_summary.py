@@ -0,0 +1,93 @@
+"""Summarize where request time goes across the bot's JSONL trace files
+
+Examples:
+    python scripts/trace_summary.py data/traces.jsonl
+    python scripts/trace_summary.py data/traces.jsonl* --slowest 5
+    python scripts/trace_summary.py data/traces.worker*.jsonl --name utterance
+"""
+import argparse
+import json
+import statistics
+import sys
+from collections import defaultdict
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def load_traces(paths, name=None):
+    traces = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    trace = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"⚠️ Skipping malformed line {path}:{line_number}", file=sys.stderr)
+                    continue
+                if trace.get('duration') is not None and (name is None or trace.get('name') == name):
+                    traces.append(trace)
+    return traces
+
+
+def summarize_spans(traces):
+    """Per-stage timings; a stage that ran several times in one request is counted once, with its summed time"""
+    per_stage = defaultdict(list)
+    for trace in traces:
+        totals = defaultdict(float)
+        for span in trace['spans']:
+            totals[span['name']] += span['duration']
+        for stage, duration in totals.items():
+            per_stage[stage].append(duration)
+    return per_stage
+
+
+def print_summary(traces, slowest=0):
+    durations = [trace['duration'] for trace in traces]
+    total_time = sum(durations)
+    slow = sum(1 for trace in traces if trace['attrs'].get('slow'))
+    errors = sum(1 for trace in traces if 'error' in trace['attrs'])
+    print(f"📊 {len(traces)} traces, {slow} slow, {errors} with errors")
+    print(f"   request p50 {percentile(durations, 50) * 1000:.1f} ms, p95 {percentile(durations, 95) * 1000:.1f} ms, "
+          f"p99 {percentile(durations, 99) * 1000:.1f} ms, max {max(durations) * 1000:.1f} ms\n")
+
+    per_stage = summarize_spans(traces)
+    print(f"  {'stage':<18}{'requests':>9}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'time %':>8}")
+    for stage, values in sorted(per_stage.items(), key=lambda item: sum(item[1]), reverse=True):
+        # Concurrent spans (e.g. parallel downloads) can add up to more than 100%
+        share = sum(values) / total_time * 100 if total_time else 0
+        print(f"  {stage:<18}{len(values):>9}{statistics.fmean(values) * 1000:>10.1f}"
+              f"{percentile(values, 50) * 1000:>10.1f}{percentile(values, 95) * 1000:>10.1f}"
+              f"{max(values) * 1000:>10.1f}{share:>7.1f}%")
+
+    errors_by_kind = defaultdict(int)
+    for trace in traces:
+        if 'error' in trace['attrs']:
+            errors_by_kind[trace['attrs']['error']] += 1
+    if errors_by_kind:
+        print('\n  errors: ' + ', '.join(f'{kind} x{count}' for kind, count in sorted(errors_by_kind.items())))
+
+    for trace in sorted(traces, key=lambda trace: trace['duration'], reverse=True)[:slowest]:
+        print(f"\n🐢 {trace['trace_id']} ({trace['name']}) {trace['duration'] * 1000:.1f} ms {trace['attrs']}")
+        for span in trace['spans']:
+            print(f"   {span['start']:+8.3f}s  {span['name']:<18} {span['duration'] * 1000:9.1f} ms  "
+                  f"{span.get('attrs', '')}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarize request traces written by the bot')
+    parser.add_argument('paths', nargs='+', help='trace files (rotated backups can be included)')
+    parser.add_argument('--name', help='only include traces of this kind (message or utterance)')
+    parser.add_argument('--slowest', type=int, default=0, help='also print the span breakdown of the N slowest')
+    args = parser.parse_args()
+
+    traces = load_traces(args.paths, args.name)
+    if not traces:
+        sys.exit('No traces found')
+    print_summary(traces, args.slowest)
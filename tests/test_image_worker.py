@@ -0,0 +1,41 @@
+"""image_worker tests on generated images"""
+import io
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from image_worker import image_scale, shrink_image
+
+SETTINGS = dict(pil_format='JPEG', quality=85, max_side=1024, max_pixels=1_000_000, passthrough_bytes=64 * 1024)
+
+
+def encode(image, image_format, **kwargs):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **kwargs)
+    return buffer.getvalue()
+
+
+def noise(size):
+    return Image.effect_noise(size, 64).convert('RGB')
+
+
+def test_image_scale_applies_the_tighter_cap():
+    assert image_scale((800, 600), 1024, 1_000_000) == 1.0
+    assert image_scale((4096, 1024), 1024, 10_000_000) == 0.25
+    assert image_scale((2000, 2000), 4096, 1_000_000) == 0.5
+
+
+def test_large_image_is_downscaled_within_the_byte_budget():
+    output = shrink_image(encode(noise((1600, 1200)), 'PNG'), 150_000, **SETTINGS)
+    with Image.open(io.BytesIO(output)) as image:
+        assert image.format == 'JPEG'
+        assert max(image.size) <= 1024
+    assert len(output) <= 150_000
+
+
+def test_small_and_animated_images_are_sent_unchanged():
+    assert shrink_image(encode(noise((64, 64)), 'PNG'), 1_000_000, **SETTINGS) is None
+    frames = [noise((600, 600)).convert('P') for _ in range(2)]
+    animated = encode(frames[0], 'GIF', save_all=True, append_images=frames[1:])
+    assert shrink_image(animated, 100_000, **SETTINGS) is None
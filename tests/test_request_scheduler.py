@@ -0,0 +1,46 @@
+"""RequestScheduler coalescing tests with stand-in messages"""
+import asyncio
+from types import SimpleNamespace
+
+from discord_bot import RequestScheduler
+
+
+def message(content, channel_id, author_id=1):
+    return SimpleNamespace(content=content, channel=SimpleNamespace(id=channel_id),
+                           author=SimpleNamespace(id=author_id), guild=None)
+
+
+def run_batches(messages):
+    """Submit messages to one lane while its first request is running; returns each batch's contents"""
+    batches = []
+
+    async def handler(batch):
+        batches.append([item.content for item in batch])
+        await asyncio.sleep(0.05)
+
+    async def run():
+        # One lane for everything, like SESSION_SCOPE=user
+        scheduler = RequestScheduler(handler, debounce=0.02, max_debounce=1, key_func=lambda item: 'user-1')
+        scheduler.submit(message('first', channel_id=10))
+        await asyncio.sleep(0)
+        for item in messages:
+            assert scheduler.submit(item)
+        while scheduler.pending:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(run())
+    return batches
+
+
+def test_rapid_messages_in_one_channel_are_merged():
+    assert run_batches([message('a', 10), message('b', 10)]) == [['first'], ['a', 'b']]
+
+
+def test_messages_in_different_channels_of_one_lane_are_not_merged():
+    batches = run_batches([message('a', 10), message('b', 20), message('c', 20)])
+    assert batches == [['first'], ['a'], ['b', 'c']]
+
+
+def test_messages_from_different_users_are_not_merged():
+    batches = run_batches([message('a', 10, author_id=1), message('b', 10, author_id=2)])
+    assert batches == [['first'], ['a'], ['b']]
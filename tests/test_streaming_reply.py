@@ -0,0 +1,74 @@
+"""split_message and StreamingReply tests at Discord's message length limit"""
+import asyncio
+
+from discord_bot import DISCORD_MESSAGE_LIMIT, STREAM_CURSOR, StreamingReply, split_message
+
+
+class SentMessage:
+    def __init__(self, content):
+        self.content = content
+        self.deleted = False
+
+    async def edit(self, content=None):
+        self.content = content
+
+    async def delete(self):
+        self.deleted = True
+
+
+class Channel:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content):
+        message = SentMessage(content)
+        self.sent.append(message)
+        return message
+
+    def visible(self):
+        return [message.content for message in self.sent if not message.deleted]
+
+
+def stream(text, prefix='@user, '):
+    channel = Channel()
+
+    async def run():
+        reply = StreamingReply(channel, prefix, edit_interval=0)
+        await reply.start()
+        for start in range(0, len(text), 100):
+            await reply.append(text[start:start + 100])
+        await reply.flush(final=True)
+
+    asyncio.run(run())
+    return channel.visible()
+
+
+def test_split_message_at_the_limit():
+    assert split_message('x' * 2000) == ['x' * 2000]
+    assert split_message('x' * 2001) == ['x' * 2000, 'x']
+    assert split_message('a' * 1500 + ' ' + 'b' * 600) == ['a' * 1500, 'b' * 600]
+    assert split_message('') == ['']
+
+
+def test_reply_just_under_the_limit_leaves_no_stale_overflow_message():
+    limit = DISCORD_MESSAGE_LIMIT - len(STREAM_CURSOR)
+    for length in range(limit - 2, DISCORD_MESSAGE_LIMIT + 3):
+        text = 'word ' * (length // 5) + 'x' * (length % 5)
+        messages = stream(text, prefix='')
+        assert ''.join(messages).replace(' ', '') == text.replace(' ', '')
+        assert all(len(message) <= DISCORD_MESSAGE_LIMIT for message in messages)
+        assert not any(message.endswith(STREAM_CURSOR) for message in messages)
+
+
+def test_extra_messages_are_removed_when_the_text_shrinks():
+    channel = Channel()
+
+    async def run():
+        reply = StreamingReply(channel)
+        await reply._render(['a', 'b'])
+        await reply._render(['ab'])
+        return reply
+
+    reply = asyncio.run(run())
+    assert channel.visible() == ['ab']
+    assert len(reply.messages) == 1
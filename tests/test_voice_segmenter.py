@@ -0,0 +1,91 @@
+"""VoiceSegmenter tests driven by synthetic 48 kHz stereo PCM, like Discord's decoded voice packets"""
+import io
+import math
+import wave
+from array import array
+
+import discord_bot
+from discord_bot import VoiceSegmenter, downsample_to_speech
+
+FRAME = discord_bot.VAD_FRAME_MS / 1000
+FRAME_SAMPLES = discord_bot.DISCORD_PCM_RATE * discord_bot.VAD_FRAME_MS // 1000
+
+
+def pcm_frame(amplitude, index=0):
+    """One 20 ms frame of a 300 Hz tone (silence when amplitude is 0)"""
+    samples = array('h')
+    for i in range(FRAME_SAMPLES):
+        t = (index * FRAME_SAMPLES + i) / discord_bot.DISCORD_PCM_RATE
+        value = int(amplitude * math.sin(2 * math.pi * 300 * t))
+        samples.extend((value, value))
+    return samples.tobytes()
+
+
+class Feeder:
+    """Feeds frames to a segmenter on a fake clock"""
+
+    def __init__(self, **kwargs):
+        self.utterances = []
+        self.segmenter = VoiceSegmenter(lambda speaker, wav: self.utterances.append((speaker, wav)), **kwargs)
+        self.now = 0.0
+        self.index = 0
+
+    def feed(self, amplitude, frames, speaker=1):
+        for _ in range(frames):
+            self.segmenter.feed(speaker, pcm_frame(amplitude, self.index), now=self.now)
+            self.now += FRAME
+            self.index += 1
+
+    def idle(self, seconds):
+        self.now += seconds
+        self.segmenter.flush_idle(now=self.now)
+
+
+def wav_info(wav_data):
+    with wave.open(io.BytesIO(wav_data)) as wav_file:
+        return wav_file.getframerate(), wav_file.getnchannels(), wav_file.getnframes() / wav_file.getframerate()
+
+
+def test_downsample_to_speech_converts_to_16khz_mono():
+    assert len(downsample_to_speech(pcm_frame(1000))) == FRAME_SAMPLES // 3
+
+
+def test_utterance_ends_after_silence_and_includes_preroll():
+    feeder = Feeder(silence_ms=800, preroll_ms=200)
+    feeder.feed(0, 10)
+    feeder.feed(8000, 50)  # one second of speech
+
+    feeder.idle(0.5)
+    assert feeder.utterances == []
+    feeder.idle(0.5)
+
+    [(speaker, wav_data)] = feeder.utterances
+    rate, channels, duration = wav_info(wav_data)
+    assert speaker == 1
+    assert (rate, channels) == (discord_bot.SPEECH_SAMPLE_RATE, 1)
+    assert math.isclose(duration, 1.2, abs_tol=0.021)
+
+
+def test_short_blips_are_discarded():
+    feeder = Feeder(min_utterance_ms=400)
+    feeder.feed(8000, 5)  # 100 ms
+    feeder.idle(2)
+    assert feeder.utterances == []
+    assert feeder.segmenter.stats['discarded'] == 1
+
+
+def test_long_speech_is_split_at_the_maximum_length():
+    feeder = Feeder(max_utterance_seconds=1)
+    feeder.feed(8000, 60)
+    assert len(feeder.utterances) == 1
+    assert feeder.segmenter.stats['truncated'] == 1
+    assert math.isclose(wav_info(feeder.utterances[0][1])[2], 1.0, abs_tol=0.021)
+
+
+def test_speakers_are_segmented_independently():
+    feeder = Feeder()
+    for _ in range(30):
+        feeder.feed(8000, 1, speaker=1)
+        feeder.feed(0, 1, speaker=2)
+    feeder.idle(2)
+    assert [speaker for speaker, _ in feeder.utterances] == [1]